@@ -1,11 +1,14 @@
-from .panel_client import init
+from .panel_client import init, Endpoint
 from .events import on_connect, on_disconnect
 from .ac import ACs, AC, State
 from . import blocks
 from .blocks import Block
 from . import pt
+from . import metrics
+from .timers import call_at, call_later, Timer
+from . import aio
 
 __all__ = [
-    'init', 'on_connect', 'on_disconnect', 'ACs', 'AC', 'State', 'blocks',
-    'Block', 'pt',
+    'init', 'Endpoint', 'on_connect', 'on_disconnect', 'ACs', 'AC', 'State', 'blocks',
+    'Block', 'pt', 'metrics', 'aio', 'call_at', 'call_later', 'Timer',
 ]
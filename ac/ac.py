@@ -1,11 +1,14 @@
 """AC class definition & AC storage definition."""
 
 from enum import Enum
-from typing import Callable, List, Any, Dict, TypeVar, DefaultDict
+from typing import Callable, List, Any, Dict, TypeVar, DefaultDict, Optional
 import logging
 
+from . import events
+from . import message_parser
 from . import panel_client
 from . import pt
+from . import timers
 
 
 class State(Enum):
@@ -25,8 +28,12 @@ class AC:
     To implement specific AC functionality, one should inherit its own class
     from 'AC' class and implement AC-specific functionality in bodies of 'on_*' methods
     or react to e.g. blocks change (see blocks.py). See examples.
+    'on_*' methods could be 'async def' (see aio.py).
     """
 
+    STATESTR_DELAY = 0.1  # seconds, `statestr_send` calls within are merged
+    STATESTR_MAX_LINES = 500  # older lines of 'state' string are dropped
+
     def __init__(self, id_: str, password: str = '') -> None:
         self.id = id_
         self.password = password
@@ -34,6 +41,8 @@ class AC:
         self.registered = False
         self.statestr = ''
         self.fg_color = 0xFFFF00
+        self._statestr_sent: Optional[str] = None
+        self._statestr_timer: Optional[timers.Timer] = None
 
     def on_register(self) -> None:
         """
@@ -101,20 +110,25 @@ class AC:
 
     def done(self) -> None:
         """Call when you need to signalize that the AC is finished."""
-        panel_client.send(f'-;AC;{self.id};CONTROL;DONE')
+        try:
+            if self._statestr_timer is not None:
+                self.statestr_flush()
+        finally:
+            self._send('CONTROL', 'DONE')
 
     def disp_error(self, message: str) -> None:
         """Display error to the dispatcher."""
-        panel_client.send(f'-;AC;{self.id};CONTROL;ERROR;DISPBOTTOM;{message}')
+        self._send('CONTROL', 'ERROR', 'DISPBOTTOM', message)
 
     def register(self, password: str) -> None:
         self.statestr = ''
+        self._statestr_sent = None
         self.password = password
-        panel_client.send(f'-;AC;{self.id};LOGIN;{password}')
+        self._send('LOGIN', password)
 
     def unregister(self) -> None:
         self.password = ''
-        panel_client.send(f'-;AC;{self.id};LOGOUT')
+        self._send('LOGOUT')
 
     """
     AC client can send multiline 'state' messages to the server.
@@ -122,35 +136,59 @@ class AC:
     """
 
     def statestr_send(self) -> None:
-        """Send whole 'state' string to the hJOPserver."""
-        assert '{' not in self.statestr and '}' not in self.statestr
-        lines = ','.join(['{'+line+'}' for line in self.statestr.split('\n')])
-        lines = '{' + lines + '}'
-        panel_client.send(f'-;AC;{self.id};CONTROL;STATE;{lines}')
+        """
+        Send whole 'state' string to the hJOPserver. Sending is delayed by
+        STATESTR_DELAY, so multiple calls result in single message.
+        """
+        if self._statestr_timer is None:
+            self._statestr_timer = timers.call_later(
+                self.STATESTR_DELAY, panel_client.dispatch, self.id, self.statestr_flush,
+            )
+
+    def statestr_flush(self) -> None:
+        """Send 'state' string now (if changed since last sending)."""
+        if self._statestr_timer is not None:
+            self._statestr_timer.cancel()
+            self._statestr_timer = None
+        self._statestr_trim()
+        if self.statestr == self._statestr_sent:
+            return
+        lines = message_parser.serialize(self.statestr.split('\n'), ',', force=True)
+        self._send('CONTROL', 'STATE', lines)
+        self._statestr_sent = self.statestr
 
     def statestr_add(self, s: str) -> None:
-        """Add single line to the 'state' string."""
-        assert '{' not in s and '}' not in s
-        self.statestr += s + '\n'
+        """Add single line to the 'state' string (unbalanced braces are replaced)."""
+        self.statestr += message_parser.balance(s) + '\n'
+        self._statestr_trim()
+
+    def _statestr_trim(self) -> None:
+        if self.statestr.count('\n') > self.STATESTR_MAX_LINES:
+            lines = self.statestr.split('\n')
+            self.statestr = '\n'.join(lines[-self.STATESTR_MAX_LINES-1:])
 
     def set_color(self, color: int) -> None:
         """Set color of the AC block in hJOPpanel (e.g. to indicate warning/error state)."""
         self.color = color
         hexcolor = hex(color)[2:].zfill(6)
-        panel_client.send(f'-;AC;{self.id};CONTROL;FG-COLOR;{hexcolor}')
+        self._send('CONTROL', 'FG-COLOR', hexcolor)
+
+    def _send(self, *items: str) -> None:
+        """Send message '-;AC;<id>;<items>' to the hJOPserver."""
+        panel_client.send(message_parser.serialize(['-', 'AC', self.id, *items]))
 
     def on_message(self, parsed: List[str]) -> None:
         if parsed[3] == 'AUTH':
             assert len(parsed) >= 5
             if parsed[4] == 'ok':
                 self.registered = True
-                self.on_register()
+                events.run(self.on_register)
             elif parsed[4] == 'nok':  # TODO
                 self.registered = False
                 logging.error(f'Registration error {parsed[5]}: {parsed[6]}')
             elif parsed[4] == 'logout':
                 self.registered = False
-                self.on_unregister()
+                events.run(self.on_unregister)
 
         elif parsed[3] == 'CONTROL':
             assert len(parsed) >= 5
@@ -167,7 +205,7 @@ class AC:
 
             event = 'on_' + parsed[4].lower()
             if hasattr(self, event):
-                getattr(self, event)()
+                events.run(getattr(self, event))
 
     def pt_get(self, path: str) -> Dict[str, Any]:
         return pt.get(path)
@@ -175,6 +213,12 @@ class AC:
     def pt_put(self, path: str, req_data: Dict[str, Any]) -> Dict[str, Any]:
         return pt.put(path, req_data, self.id, self.password)
 
+    async def pt_get_async(self, path: str) -> Dict[str, Any]:
+        return await pt.get_async(path)
+
+    async def pt_put_async(self, path: str, req_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await pt.put_async(path, req_data, self.id, self.password)
+
 
 KT = TypeVar('KT')
 VT = TypeVar('VT')
@@ -0,0 +1,199 @@
+"""
+asyncio-based panel client, alternative to blocking `ac.init`.
+
+Messages are read by asyncio streams. Block state for CHANGE events is
+fetched in executor, so slow PT server does not delay PING processing or
+messages for other ACs. Handlers (AC 'on_*' methods, block change callbacks,
+global events) could be both plain functions and 'async def' coroutines.
+Async handlers should use `pt.get_async`/`pt.put_async` (or
+`AC.pt_get_async`/`AC.pt_put_async`) for PT requests.
+
+Example:
+    ACs['5000'] = MyAC('5000', 'password')
+    ac.aio.run('127.0.0.1', 5896)
+"""
+
+import asyncio
+import logging
+import socket
+import threading
+import traceback
+from typing import Any, Dict, Optional, Sequence, Union
+
+from . import blocks
+from . import events
+from . import panel_client
+from . import pt
+from . import timers
+
+READ_LIMIT = 2**20  # maximum length of single message (bytes)
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[int] = None
+_wakeup: Optional[asyncio.Event] = None
+_changing: Dict[str, bool] = {}  # block id -> another CHANGE came meanwhile
+
+
+def run(server: Union[str, Sequence[Any]], port: int = 5896, app_name: str = '') -> None:
+    """Blocking entry point, equivalent to `ac.init` in asyncio mode."""
+    asyncio.run(init(server, port, app_name))
+
+
+async def init(server: Union[str, Sequence[Any]], port: int = 5896,
+               app_name: str = '') -> None:
+    """
+    Infinite coroutine to open & keep open connection with Panel server.
+    Tries to restore connection in case of connection loss.
+    `server` is a host or list of endpoints, see `ac.init`.
+    """
+    global _loop, _loop_thread, _wakeup
+    _loop = asyncio.get_running_loop()
+    _loop_thread = threading.get_ident()
+    _wakeup = asyncio.Event()
+    events.loop = _loop
+    blocks.change_handler = _on_change
+    timers.wakeup = _wake_threadsafe
+    endpoints = panel_client.endpoints(server, port)
+    panel_client.update_scheduler.period = panel_client.UPDATE_PERIOD
+
+    try:
+        while True:
+            connected = False
+            try:
+                logging.info('Initializing connection to '
+                             f'{", ".join(f"{e.host}:{e.port}" for e in endpoints)}...')
+                # Parallel connection attempts with timeout, see `panel_client._connect`
+                sock, endpoint = await _loop.run_in_executor(
+                    None, panel_client._connect, endpoints
+                )
+                reader, writer = await asyncio.open_connection(sock=sock, limit=READ_LIMIT)
+                pt.server, pt.PORT = endpoint.host, endpoint.pt_port
+                connected = True
+                panel_client.stats['connects'] += 1
+                logging.info('Socket opened')
+                await _listen(reader, writer, app_name)
+            except panel_client.DisconnectedError:
+                logging.info('Disconnected from server')
+            except (asyncio.TimeoutError, socket.timeout):
+                logging.info('Unable to connect to server')
+            except OSError as e:
+                logging.info(e)
+
+            if connected:
+                panel_client.transport = None
+                _changing.clear()
+                panel_client._on_disconnect()
+            else:
+                panel_client.stats['connect_failures'] += 1
+            await asyncio.sleep(panel_client._next_delay())
+    finally:
+        events.loop = None
+        blocks.change_handler = blocks._call_change
+        timers.wakeup = None
+        panel_client.transport = None
+
+
+async def _listen(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                  app_name: str) -> None:
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        panel_client._set_keepalive(sock)
+
+    def write(data: bytes) -> None:
+        assert _loop is not None
+        if threading.get_ident() == _loop_thread:
+            writer.write(data)
+        else:
+            _loop.call_soon_threadsafe(writer.write, data)
+
+    panel_client.transport = write
+    panel_client.send_items('-', 'HELLO', panel_client.CLIENT_PROTOCOL_VERSION, app_name)
+
+    ticker = asyncio.ensure_future(_tick())
+    try:
+        while True:
+            try:
+                try:
+                    data = await reader.readuntil(b'\n')
+                except asyncio.LimitOverrunError as e:
+                    logging.warning('Message too long, skipping!')
+                    await _skip_line(reader, e.consumed)
+                    continue
+            except asyncio.IncompleteReadError:
+                raise panel_client.DisconnectedError('Disconnected from server!')
+
+            line = data.decode('utf-8', errors='replace').replace('\r', '').strip()
+            logging.debug(f'> {line}')
+            try:
+                panel_client._process_message(None, line)
+            except Exception as e:
+                logging.warning(f'Message processing error: {str(e)}!')
+                traceback.print_exc()
+            assert _wakeup is not None
+            _wakeup.set()
+            await writer.drain()
+    finally:
+        ticker.cancel()
+        writer.close()
+
+
+async def _skip_line(reader: asyncio.StreamReader, consumed: int) -> None:
+    """Discard rest of too long line up to end of line, `consumed` bytes are buffered."""
+    while True:
+        await reader.readexactly(consumed)
+        try:
+            await reader.readuntil(b'\n')
+            return
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+
+
+async def _tick() -> None:
+    """Periodic tasks: timers & 'on_update' events."""
+    assert _wakeup is not None
+
+    while True:
+        timeout = panel_client.update_scheduler.timeout()
+        timers_timeout = timers.timeout()
+        if timers_timeout is not None:
+            timeout = min(timeout, timers_timeout)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+        timers.run_due()
+        panel_client.update_scheduler.run_due(panel_client.dispatch)
+
+
+def _wake_threadsafe() -> None:
+    if _loop is not None and _wakeup is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+def _on_change(id_: str) -> None:
+    if id_ in _changing:
+        # Fetch of this block is in progress, fetch it once more after it
+        _changing[id_] = True
+        blocks.stats['merged'] += 1
+        return
+    _changing[id_] = False
+    events.spawn(_process_change(id_))
+
+
+async def _process_change(id_: str) -> None:
+    try:
+        while True:
+            if blocks._interested(id_):
+                block = await asyncio.get_running_loop().run_in_executor(
+                    None, blocks._fetch, int(id_)
+                )
+                blocks._dispatch(id_, block)
+            else:
+                blocks.invalidate(int(id_))
+            if not _changing.get(id_):
+                break
+            _changing[id_] = False
+    finally:
+        _changing.pop(id_, None)
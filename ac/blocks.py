@@ -1,18 +1,72 @@
-"""Panel server block interaction (on_change)"""
+"""
+Panel server block interaction (on_change) & block state store.
 
-from typing import Dict, Any, Callable, List, Iterable, Union, Set, Tuple
+Changes could be received by global handlers (`on_block_change`,
+`register_change`) or by per-AC subscriptions (`subscribe`). Subscription
+callbacks are called only for ACs subscribed to the changed block (and in
+the AC's lane when `panel_client.dispatcher` is used).
+
+Store keeps last known state of blocks. State of a block registered on the
+server is kept up to date by CHANGE notifications, so handlers could read it
+via `get` or `cached` without any HTTP request.
+"""
+
+from typing import Dict, Any, Callable, List, Iterable, Union, Set, Tuple, \
+    Optional, Awaitable, TYPE_CHECKING
 from collections import defaultdict
 import logging
+import threading
+import time
+import traceback
 
+from . import events as ac_events
+from . import message_parser
+from . import metrics
 from . import panel_client
 from . import pt
+from . import timers
 
+if TYPE_CHECKING:
+    from .ac import AC
 
 Block = Dict[str, Any]
-BlockEvent = Callable[[Block], None]
+BlockEvent = Callable[[Block], Optional[Awaitable[None]]]  # sync or async
 BlockDecorator = Callable[[BlockEvent], BlockEvent]
 events: Dict[str, Set[BlockEvent]] = defaultdict(set)
 global_events: Set[BlockEvent] = set()
+# block id -> AC id -> callbacks
+subscriptions: Dict[str, Dict[str, Set[BlockEvent]]] = {}
+_ac_subscriptions: Dict[str, Set[str]] = defaultdict(set)  # AC id -> block ids
+
+# CHANGEs of the same block received within COALESCE_WINDOW seconds after
+# the first one are merged into single fetch & callbacks call. 0 = disabled.
+COALESCE_WINDOW = 0.0  # seconds
+
+# `get_many` fetches all blocks in single request when at least
+# GET_MANY_BULK_THRESHOLD blocks are not in the store, otherwise it fetches
+# the blocks one by one in parallel.
+GET_MANY_BULK_THRESHOLD = 10
+
+# Cached state of block not registered on server is considered valid for
+# CACHE_TTL seconds only (no CHANGE notifications come for such block).
+CACHE_TTL = 0.0  # seconds
+
+cache: Dict[int, Block] = {}
+stats: Dict[str, int] = {
+    'hits': 0, 'misses': 0, 'refreshes': 0, 'invalidations': 0, 'seeds': 0,
+    'changes': 0, 'merged': 0, 'rechecks': 0,
+}
+_pending_changes: Dict[str, timers.Timer] = {}  # coalesced changes
+_fetched: Dict[int, float] = {}  # block id -> time.monotonic() of fetch
+_registered: Dict[int, float] = {}  # block id -> time.monotonic() of register
+_refcounts: Dict[str, int] = {}  # block id -> number of `register` calls
+_server_registered: Set[str] = set()  # blocks registered by sent messages
+_pending_registrations: Set[str] = set()  # blocks to (un)register in this tick
+_flush_timer: Optional[timers.Timer] = None
+_registrations_lock = threading.Lock()
+_cache_lock = threading.Lock()  # guards `cache` & `_fetched`, store is used by PT threads
+_seeded = False
+_stale: Dict[int, Block] = {}  # states from before disconnect, see `resync`
 
 
 def on_block_change(*args: Union[int, str],
@@ -58,10 +112,12 @@ def register_change(func: BlockEvent, *args: Union[int, str],
     """
     global events, global_events
 
+    added = []
     for block_id in args:
         if func not in events[str(block_id)]:
             events[str(block_id)].add(func)
-    register(args)
+            added.append(block_id)
+    register(added)
     if not args:
         if func not in global_events:
             global_events.add(func)
@@ -73,40 +129,184 @@ def unregister_change(func: BlockEvent, *args: Union[int, str],
     """Unregister change event to function & server."""
     global events, global_events
 
+    removed = []
     for block_id in args:
         if func in events[str(block_id)]:
             events[str(block_id)].remove(func)
-    unregister(args)
+            removed.append(block_id)
+    unregister(removed)
     if not args:
         if func in global_events:
             global_events.remove(func)
 
 
+def subscribe(ac_: 'AC', func: BlockEvent, *args: Union[int, str]) -> None:
+    """
+    Call `func(block)` when any of blocks `args` changes. Blocks are
+    registered on server. Subscriptions are kept per AC, see `unsubscribe`.
+
+    Example:
+    def on_start(self):
+        ac.blocks.subscribe(self, self.on_track_change, 12, 24)
+    """
+    to_register = []
+    for block_id in map(str, args):
+        funcs = subscriptions.setdefault(block_id, {}).setdefault(ac_.id, set())
+        if not funcs:
+            to_register.append(block_id)  # one reference per (block, AC)
+        funcs.add(func)
+        _ac_subscriptions[ac_.id].add(block_id)
+    register(to_register)
+
+
+def unsubscribe(ac_: 'AC', func: Optional[BlockEvent] = None,
+                *args: Union[int, str]) -> None:
+    """
+    Remove subscriptions of AC `ac_` of function `func` (or of all
+    functions) to blocks `args` (or to all blocks).
+    """
+    block_ids = list(map(str, args)) if args else list(_ac_subscriptions[ac_.id])
+    to_unregister = []
+    for block_id in block_ids:
+        subscribers = subscriptions.get(block_id, {})
+        funcs = subscribers.get(ac_.id)
+        if funcs is None:
+            continue
+        if func is None:
+            funcs.clear()
+        else:
+            funcs.discard(func)
+        if funcs:
+            continue
+
+        del subscribers[ac_.id]
+        _ac_subscriptions[ac_.id].discard(block_id)
+        if not subscribers:
+            del subscriptions[block_id]
+        to_unregister.append(block_id)
+    unregister(to_unregister)
+
+
 def register(blocks: Iterable[Union[str, int]]) -> None:
     """
     Register event on server.
 
     This function should be called when using event handing via decorators.
+    Registrations are reference-counted: block stays registered until
+    `unregister` is called for it as many times as `register`. Registrations
+    are not lost on reconnect, do not register again in `on_connect`.
+    Messages are sent in batch at the end of current loop iteration, states
+    read before are read again afterwards (changes meanwhile are dispatched).
     """
-    _send('register', blocks)
+    with _registrations_lock:
+        for block_id in map(str, blocks):
+            count = _refcounts.get(block_id, 0)
+            _refcounts[block_id] = count + 1
+            if count == 0:
+                _change_registration(block_id)
 
 
 def unregister(blocks: Iterable[Union[str, int]]) -> None:
-    _send('unregister', blocks)
+    """Release registrations of `blocks` obtained by `register`."""
+    with _registrations_lock:
+        for block_id in map(str, blocks):
+            count = _refcounts.get(block_id, 0)
+            if count == 0:
+                logging.warning(f'Unregistering block {block_id} which is not registered')
+            elif count > 1:
+                _refcounts[block_id] = count - 1
+            else:
+                del _refcounts[block_id]
+                _change_registration(block_id)
+
+
+def registered() -> Set[int]:
+    """Return ids of blocks which should be registered on server."""
+    with _registrations_lock:
+        return set(map(int, _live()))
+
+
+def _live() -> Set[str]:
+    return set(_refcounts.keys())
+
+
+def _change_registration(block_id: str) -> None:
+    """Add (un)registration of block to the pending batch (lock is held)."""
+    global _flush_timer
+    if (block_id in _refcounts) == (block_id in _server_registered):
+        _pending_registrations.discard(block_id)  # change undone in this tick
+    else:
+        _pending_registrations.add(block_id)
+    if _flush_timer is None:
+        _flush_timer = timers.call_later(0, _flush_registrations)
+
+
+def _flush_registrations() -> None:
+    """Send pending changes as single REGISTER & single UNREGISTER message."""
+    global _flush_timer
+    with _registrations_lock:
+        _flush_timer = None
+        to_register = sorted(
+            (id_ for id_ in _pending_registrations if id_ not in _server_registered), key=int
+        )
+        to_unregister = sorted(
+            (id_ for id_ in _pending_registrations if id_ in _server_registered), key=int
+        )
+        _pending_registrations.clear()
+        if panel_client.panel_socket is None and panel_client.transport is None:
+            return  # live set is replayed on connect
+        _server_registered.update(to_register)
+        _server_registered.difference_update(to_unregister)
+        # Stored states are up to date only when fetched after REGISTER
+        now = time.monotonic()
+        for block_id in to_register:
+            _registered[int(block_id)] = now
+        for block_id in to_unregister:
+            _registered.pop(int(block_id), None)
+
+    if to_register:
+        _send('register', to_register)
+        with _cache_lock:
+            stale = {int(id_): cache[int(id_)] for id_ in to_register if int(id_) in cache}
+        if stale:
+            # Change before REGISTER is not notified, read again after REGISTER is sent
+            timers.call_later(0, _recheck, stale)
+    if to_unregister:
+        _send('unregister', to_unregister)
+
+
+def _recheck(stale: Dict[int, Block]) -> None:
+    stats['rechecks'] += 1
+    threading.Thread(
+        target=_resync, args=(set(stale), stale, None), name='recheck', daemon=True,
+    ).start()
 
 
 def _send(command: str, blocks: Iterable[Union[str, int]]) -> None:
     _blocks = map(str, blocks)
-    panel_client.send('-;AC;-;BLOCKS;' + command.upper() +
-                      ';{' + (','.join(_blocks))+'}')
+    panel_client.send(message_parser.serialize([
+        '-', 'AC', '-', 'BLOCKS', command.upper(),
+        message_parser.serialize(_blocks, ','),
+    ]))
 
 
 def _send_all_registrations() -> None:
-    global events
-
-    all_ = set(list(events.keys()))
-    if all_:
-        register(all_)
+    """Replay live registrations after (re)connect."""
+    global _flush_timer
+    now = time.monotonic()
+    with _registrations_lock:
+        live = _live()
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+            _flush_timer = None
+        _pending_registrations.clear()
+        _server_registered.clear()
+        _server_registered.update(live)
+        for block_id in live:
+            _registered[int(block_id)] = now
+
+    if live:
+        _send('register', sorted(live, key=int))
 
 
 def on_message(parsed: List[str]) -> None:
@@ -119,18 +319,59 @@ def on_message(parsed: List[str]) -> None:
             message = f': {parsed[7]}' if len(parsed) >= 8 else ''
             logging.error(f'Block {parsed[5]} register error: {message}')
     elif parsed[4] == 'CHANGE':
-        _call_change(parsed[5])
+        _on_change(parsed[5])
     elif parsed[4] == 'LIST':
         pass  # TODO if needed
 
 
+def _on_change(id_: str) -> None:
+    stats['changes'] += 1
+    if COALESCE_WINDOW <= 0:
+        panel_client.dispatch('blocks', change_handler, id_)
+        return
+
+    invalidate(int(id_))  # cached state is outdated now
+    if id_ in _pending_changes:
+        stats['merged'] += 1
+    else:
+        _pending_changes[id_] = timers.call_later(COALESCE_WINDOW, _flush_change, id_)
+
+
+def _flush_change(id_: str) -> None:
+    """Process pending change with elapsed coalesce window."""
+    del _pending_changes[id_]
+    panel_client.dispatch('blocks', change_handler, id_)
+
+
 def _call_change(id_: str) -> None:
-    pt_block = pt.get(f'/blocks/{id_}?state=true')['block']
+    if not _interested(id_):
+        # Nobody waits for the block now, fetch it lazily when requested
+        invalidate(int(id_))
+        return
+    _dispatch(id_, _fetch(int(id_)))
+
+
+def _interested(id_: str) -> bool:
+    return bool(global_events or events.get(id_) or subscriptions.get(id_))
+
+
+def _dispatch(id_: str, pt_block: Block) -> None:
+    stats['refreshes'] += 1
     # Use copy because callback could change the set
     for event in global_events.copy():
-        event(pt_block)
+        ac_events.run(metrics.wrap('block_callback', event), pt_block)
     for event in events[id_].copy():
-        event(pt_block)
+        ac_events.run(metrics.wrap('block_callback', event), pt_block)
+    for ac_id, funcs in list(subscriptions.get(id_, {}).items()):
+        for func in list(funcs):
+            try:
+                panel_client.dispatch(ac_id, metrics.wrap('block_callback', func), pt_block)
+            except Exception:
+                traceback.print_exc()  # do not affect other ACs
+
+
+# Processes CHANGE of block (after coalescing), replaced in `ac.aio`
+change_handler: Callable[[str], None] = _call_change
 
 
 def dict(state: bool = False) -> Dict[int, Block]:
@@ -141,3 +382,167 @@ def dict(state: bool = False) -> Dict[int, Block]:
         int(block['id']): block
         for block in pt.get(url)['blocks']
     }
+
+
+def _store(block: Block) -> Block:
+    block_id = int(block['id'])
+    with _cache_lock:
+        cache[block_id] = block
+        _fetched[block_id] = time.monotonic()
+    return block
+
+
+def _fetch(id_: int) -> Block:
+    return _store(pt.get(f'/blocks/{id_}?state=true')['block'])
+
+
+def _lookup(id_: int) -> Optional[Block]:
+    """Return stored block if its state is known to be up to date."""
+    with _cache_lock:
+        block = cache.get(id_)
+        if block is None:
+            return None
+        registered_at = _registered.get(id_)
+        if registered_at is not None and _fetched[id_] >= registered_at:
+            return block
+        return block if time.monotonic() - _fetched[id_] < CACHE_TTL else None
+
+
+def seed() -> Dict[int, Block]:
+    """Fill the store with state of all blocks (single PT request)."""
+    global _seeded
+    blocks = dict(state=True)
+    for block in blocks.values():
+        _store(block)
+    _seeded = True
+    stats['seeds'] += 1
+    return blocks
+
+
+def cached(id_: Union[str, int]) -> Optional[Block]:
+    """Return last known block (with state) without any PT request."""
+    return cache.get(int(id_))
+
+
+def get(id_: Union[str, int]) -> Block:
+    """
+    Return block with its state. State is read from the store when it is
+    known to be up to date, otherwise it is fetched from the PT server.
+    """
+    block_id = int(id_)
+    block = _lookup(block_id)
+    if block is not None:
+        stats['hits'] += 1
+        return block
+
+    stats['misses'] += 1
+    if not _seeded:
+        block = seed().get(block_id)
+        if block is not None:
+            return block
+    return _fetch(block_id)
+
+
+def get_many(ids: Iterable[Union[str, int]]) -> Dict[int, Block]:
+    """
+    Return multiple blocks with their state ({id: block}) using as few PT
+    requests as possible.
+    """
+    # Result is built from looked up & fetched blocks, store could be
+    # invalidated by panel client thread meanwhile
+    result: Dict[int, Block] = {}
+    missing = []
+    for block_id in set(map(int, ids)):
+        block = _lookup(block_id)
+        if block is None:
+            missing.append(block_id)
+        else:
+            result[block_id] = block
+    stats['hits'] += len(result)
+    stats['misses'] += len(missing)
+
+    if missing and (not _seeded or len(missing) >= GET_MANY_BULK_THRESHOLD):
+        blocks = seed()
+        result.update((block_id, blocks[block_id]) for block_id in missing if block_id in blocks)
+        missing = [block_id for block_id in missing if block_id not in blocks]
+
+    for response in pt.get_many(f'/blocks/{block_id}?state=true' for block_id in missing):
+        block = _store(response['block'])
+        result[int(block['id'])] = block
+    return result
+
+
+def state(id_: Union[str, int]) -> Dict[str, Any]:
+    """Return state of block (block['blockState'])."""
+    return get(id_)['blockState']  # type: ignore
+
+
+def invalidate(id_: Optional[int] = None) -> None:
+    """Forget state of block `id_` (or of all blocks)."""
+    global _seeded
+    stats['invalidations'] += 1
+    with _cache_lock:
+        if id_ is None:
+            cache.clear()
+            _fetched.clear()
+            _seeded = False
+        else:
+            cache.pop(id_, None)
+            _fetched.pop(id_, None)
+
+
+def _on_disconnect() -> None:
+    # Changes are not received when disconnected
+    global _flush_timer
+    with _registrations_lock:
+        _registered.clear()
+        _server_registered.clear()
+        _pending_registrations.clear()
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+            _flush_timer = None
+    for timer in _pending_changes.values():
+        timer.cancel()
+    _pending_changes.clear()
+    with _cache_lock:
+        known = cache.copy()
+    for id_, block in known.items():
+        _stale.setdefault(id_, block)  # states known to handlers
+    invalidate()
+
+
+def resync(on_done: Optional[Callable[[], None]] = None) -> None:
+    """
+    Refresh state of registered blocks after reconnect (in background, in
+    bulk) and call change handlers of blocks changed while disconnected.
+    `on_done` is called in panel client thread afterwards.
+    """
+    global _stale
+    stale, _stale = _stale, {}
+    ids = registered()
+    if not ids:
+        _resync_done(stale, {}, on_done)
+        return
+    threading.Thread(
+        target=_resync, args=(ids, stale, on_done), name='resync', daemon=True,
+    ).start()
+
+
+def _resync(ids: Set[int], stale: Dict[int, Block],
+            on_done: Optional[Callable[[], None]]) -> None:
+    try:
+        fresh = get_many(ids)
+    except Exception:
+        traceback.print_exc()
+        fresh = {}
+    timers.call_later(0, _resync_done, stale, fresh, on_done)
+
+
+def _resync_done(stale: Dict[int, Block], fresh: Dict[int, Block],
+                 on_done: Optional[Callable[[], None]]) -> None:
+    for id_, block in fresh.items():
+        if id_ in stale and stale[id_] != block:
+            # In order with CHANGEs, AC callbacks go to lanes of the ACs
+            panel_client.dispatch('blocks', _dispatch, str(id_), block)
+    if on_done is not None:
+        on_done()
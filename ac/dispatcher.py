@@ -0,0 +1,90 @@
+"""
+Thread pool for running event handlers off the socket thread.
+
+Handlers are submitted with a key (e.g. AC id). Handlers with the same key
+are run serially in order of submission, handlers with different keys run
+in parallel.
+"""
+
+from collections import deque
+import concurrent.futures
+import threading
+import traceback
+from typing import Any, Callable, Deque, Dict, Tuple
+
+from . import events
+
+_Call = Tuple[Callable[..., Any], Tuple[Any, ...]]
+
+
+class Dispatcher:
+    """
+    Bounded thread pool with per-key serialization.
+
+    When `max_queue` handlers are queued or running, `submit` called from
+    socket thread blocks until some handler finishes (back-pressure, socket
+    is not read meanwhile). `submit` called from a handler never blocks.
+    """
+
+    def __init__(self, workers: int = 4, max_queue: int = 1000) -> None:
+        self.max_queue = max_queue
+        self.depth = 0  # handlers queued or running
+        self.stats: Dict[str, int] = {
+            'submitted': 0, 'completed': 0, 'errors': 0, 'max_depth': 0,
+            'blocked': 0,
+        }
+        self._queues: Dict[str, Deque[_Call]] = {}
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='ac-dispatch',
+        )
+
+    def submit(self, key: str, func: Callable[..., Any], *args: Any) -> None:
+        with self._cond:
+            if self.depth >= self.max_queue and not getattr(self._local, 'worker', False):
+                self.stats['blocked'] += 1
+                while self.depth >= self.max_queue:
+                    self._cond.wait()
+
+            self.depth += 1
+            self.stats['submitted'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], self.depth)
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append((func, args))  # key is being processed
+                return
+            self._queues[key] = deque([(func, args)])
+        self._executor.submit(self._drain, key)
+
+    def queue_depth(self, key: str = '') -> int:
+        """Return number of pending handlers (with `key` or all)."""
+        with self._cond:
+            if key:
+                return len(self._queues.get(key, ()))
+            return self.depth
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def _drain(self, key: str) -> None:
+        self._local.worker = True
+        while True:
+            with self._cond:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                func, args = queue[0]
+
+            try:
+                events.run(func, *args)
+            except Exception:
+                self.stats['errors'] += 1
+                traceback.print_exc()
+
+            with self._cond:
+                queue.popleft()
+                self.depth -= 1
+                self.stats['completed'] += 1
+                self._cond.notify_all()
@@ -1,13 +1,23 @@
 """Package event definitions. This file implements decorators to easily
-register events. See examples below."""
+register events. See examples below.
 
+Any event handler (including `on_*` methods of AC and block change
+callbacks) could be `async def`. Its coroutine is scheduled in event loop of
+`ac.aio` when running in asyncio mode, otherwise it is run to completion
+immediately."""
+
+import asyncio
+import inspect
 import traceback
-from typing import Callable, List
+from typing import Any, Callable, Coroutine, List, Optional, Set
 
 evs_on_connect: List[Callable[[], None]] = []
 evs_on_disconnect: List[Callable[[], None]] = []
 evs_on_update: List[Callable[[], None]] = []
 
+loop: Optional[asyncio.AbstractEventLoop] = None  # set by `ac.aio`
+_tasks: Set['asyncio.Task[None]'] = set()
+
 
 def on_connect(func: Callable[[], None]) -> Callable[[], None]:
     evs_on_connect.append(func)
@@ -27,6 +37,39 @@ def on_update(func: Callable[[], None]) -> Callable[[], None]:
 def call(events: List[Callable[[], None]]) -> None:
     for event in events:
         try:
-            event()
+            run(event)
         except Exception:
             traceback.print_exc()
+
+
+def run(func: Callable[..., Any], *args: Any) -> None:
+    """Call event handler, schedule coroutine in case of async handler."""
+    result = func(*args)
+    if inspect.iscoroutine(result):
+        spawn(result)
+
+
+def spawn(coro: Coroutine[Any, Any, Any]) -> None:
+    """Schedule coroutine in `ac.aio` loop, run it now without such loop."""
+    if loop is None:
+        asyncio.run(_guard(coro))
+        return
+
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+
+    if running is loop:
+        task = loop.create_task(_guard(coro))
+        _tasks.add(task)  # keep reference until done
+        task.add_done_callback(_tasks.discard)
+    else:
+        asyncio.run_coroutine_threadsafe(_guard(coro), loop)
+
+
+async def _guard(coro: Coroutine[Any, Any, Any]) -> None:
+    try:
+        await coro
+    except Exception:
+        traceback.print_exc()
@@ -1,6 +1,24 @@
-"""This file is a parser helper. It allows parsing data from server."""
+"""
+This file is a parser helper. It allows parsing data from server and
+serializing data for server.
+"""
 
-from typing import List
+import functools
+import re
+from typing import Iterable, List, Pattern
+
+SPECIAL = ';,{}'  # items containing these characters are escaped
+
+
+@functools.lru_cache(maxsize=None)
+def _tokens(separators: str) -> Pattern[str]:
+    """Matches start of escaped part or separator."""
+    return re.compile('[{' + re.escape(separators) + ']')
+
+
+@functools.lru_cache(maxsize=None)
+def _splitter(separators: str) -> Pattern[str]:
+    return re.compile('[' + re.escape(separators) + ']')
 
 
 def parse(data: str, separators: str) -> List[str]:
@@ -8,30 +26,94 @@ def parse(data: str, separators: str) -> List[str]:
     This function parses string into list of strings based on 'separators'.
     It follows hJOPserver`s PanelServer messages format.
     """
-    output: List[str] = []
-    item = ''
-    escaped_level = 0
+    if '{' not in data:
+        # Fast path: no escaping, just split
+        items = _splitter(separators).split(data) if separators else [data]
+        if items[-1] == '':
+            items.pop()
+        return items
 
-    for c in data:
-        if c == '{':
-            if escaped_level > 0:
-                item += c
-            escaped_level += 1
-
-        elif (c == '}') and (escaped_level > 0):
-            escaped_level -= 1
-            if escaped_level > 0:
-                item += c
-        else:
-            if (c in separators) and (escaped_level == 0):
-                output.append(item)
-                item = ''
+    output: List[str] = []
+    parts: List[str] = []  # slices of current item
+    start = 0  # start of current slice
+    search = _tokens(separators).search
+    match = search(data)
 
+    while match is not None:
+        pos = match.start()
+        if data[pos] == '{':
+            # Escaped part: find matching '}', nested braces are kept
+            parts.append(data[start:pos])
+            start = pos + 1
+            end = start
+            escaped_level = 1
+            while escaped_level > 0:
+                close = data.find('}', end)
+                if close == -1:
+                    parts.append(data[start:])  # unterminated
+                    start = end = len(data)
+                    break
+                escaped_level += data.count('{', end, close) - 1
+                end = close + 1
             else:
-                if (c not in separators) or (escaped_level > 0):
-                    item += c
+                parts.append(data[start:end-1])
+                start = end
+            match = search(data, end)
+
+        else:
+            parts.append(data[start:pos])
+            output.append(''.join(parts))
+            parts = []
+            start = pos + 1
+            match = search(data, start)
 
+    parts.append(data[start:])
+    item = ''.join(parts)
     if item != "":
         output.append(item)
 
     return output
+
+
+def balance(item: str) -> str:
+    """
+    Replace unbalanced braces by parentheses, protocol has no way to escape
+    them. Example: balance('a } {b} {') == 'a ) {b} ('
+    """
+    if '{' not in item and '}' not in item:
+        return item
+    chars = list(item)
+    opened: List[int] = []  # positions of unclosed '{'
+    for i, c in enumerate(chars):
+        if c == '{':
+            opened.append(i)
+        elif c == '}':
+            if opened:
+                opened.pop()
+            else:
+                chars[i] = ')'
+    for i in opened:
+        chars[i] = '('
+    return ''.join(chars)
+
+
+def escape(item: str, force: bool = False) -> str:
+    """
+    Escape single item (wrap it in braces) if it contains separator or brace.
+    Unbalanced braces are replaced, see `balance`.
+    """
+    if not force and not any(c in item for c in SPECIAL):
+        return item
+    return '{' + balance(item) + '}'
+
+
+def serialize(items: Iterable[str], separator: str = ';', force: bool = False) -> str:
+    """
+    Inverse of `parse`: join items by `separator`, escape items if needed
+    (`force`: escape all items). Note that `parse` drops last item if empty.
+
+    Example:
+      serialize(['-', 'AC', '-', 'BLOCKS', 'REGISTER', serialize(['1', '2'], ',')])
+      == '-;AC;-;BLOCKS;REGISTER;{1,2}'
+    """
+    return separator.join(escape(item, force) for item in items)
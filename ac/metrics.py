@@ -0,0 +1,167 @@
+"""
+Runtime metrics of the hot path: counters and latency histograms.
+
+Instrumented: processing of panel server messages by type
+(`message.<TYPE>`), PT requests by method & path template
+(`pt.<METHOD> <path>`), block change callbacks (`block_callback.<name>`)
+and `on_update` calls (`on_update.<AC id>`).
+
+Metrics are disabled by default, instrumented code then only checks
+`metrics.enabled`.
+
+Example:
+    ac.metrics.enable(dump_period=60)  # log metrics every minute
+    ...
+    print(ac.metrics.snapshot())
+"""
+
+import functools
+import logging
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from . import timers
+
+# Upper bounds of histogram buckets (seconds), last bucket is unbounded
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+enabled = False
+counters: Dict[str, int] = {}
+histograms: Dict[str, 'Histogram'] = {}
+
+_lock = threading.Lock()
+_dump_timer: Optional[timers.Timer] = None
+_ID_RE = re.compile(r'/\d+(?=/|$)')
+
+T = TypeVar('T')
+
+
+class Histogram:
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets: List[int] = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def quantile(self, q: float) -> float:
+        """Return upper bound of bucket containing quantile `q`."""
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets[:-1]):
+            seen += count
+            if seen >= rank:
+                return min(BUCKETS[i], self.max)
+        return self.max
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([*map(str, BUCKETS), 'inf'], self.buckets)),
+        }
+
+
+def inc(name: str, value: int = 1) -> None:
+    with _lock:
+        counters[name] = counters.get(name, 0) + value
+
+
+def observe(name: str, seconds: float) -> None:
+    with _lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+
+def timed(name: str, func: Callable[..., T], *args: Any) -> T:
+    """Call `func(*args)` and observe its duration as `name`."""
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def wrap(prefix: str, func: Callable[..., T]) -> Callable[..., T]:
+    """Return `func` measured as `prefix.<func name>` (`func` if disabled)."""
+    if not enabled:
+        return func
+    name = getattr(func, '__qualname__', None) or repr(func)
+    return functools.partial(timed, f'{prefix}.{name}', func)
+
+
+def path_template(path: str) -> str:
+    """'/blocks/12?state=true' -> '/blocks/{id}'"""
+    return _ID_RE.sub('/{id}', path.split('?', 1)[0])
+
+
+def snapshot() -> Dict[str, Any]:
+    """Return copy of all metrics."""
+    with _lock:
+        return {
+            'counters': counters.copy(),
+            'histograms': {name: h.as_dict() for name, h in histograms.items()},
+        }
+
+
+def reset() -> None:
+    with _lock:
+        counters.clear()
+        histograms.clear()
+
+
+def enable(dump_period: Optional[float] = None) -> None:
+    """Enable metrics, log them every `dump_period` seconds if set."""
+    global enabled, _dump_timer
+    enabled = True
+    if _dump_timer is not None:
+        _dump_timer.cancel()
+        _dump_timer = None
+    if dump_period:
+        _dump_timer = timers.call_later(dump_period, _dump, dump_period)
+
+
+def disable() -> None:
+    global enabled, _dump_timer
+    enabled = False
+    if _dump_timer is not None:
+        _dump_timer.cancel()
+        _dump_timer = None
+
+
+def dump() -> None:
+    """Log all metrics."""
+    data = snapshot()
+    for name, value in sorted(data['counters'].items()):
+        logging.info(f'metrics: {name} = {value}')
+    for name, h in sorted(data['histograms'].items()):
+        logging.info(
+            f'metrics: {name}: n={h["count"]} mean={h["mean"]*1000:.3f} ms '
+            f'p50={h["p50"]*1000:.3f} ms p99={h["p99"]*1000:.3f} ms '
+            f'max={h["max"]*1000:.3f} ms'
+        )
+
+
+def _dump(period: float) -> None:
+    global _dump_timer
+    dump()
+    _dump_timer = timers.call_later(period, _dump, period)
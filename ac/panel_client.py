@@ -1,25 +1,64 @@
 """Panel client socket management"""
 
-from collections import deque
+import codecs
+import errno
+import itertools
+import os
 import socket
 import logging
-from typing import Optional, List
+from typing import Optional, List, Callable, Any, Dict, NamedTuple, Sequence, Tuple, \
+    Union
+import random
+import threading
 import traceback
 import time
 import select
-import datetime
 
 from . import message_parser
 from . import events
+from . import metrics
 from .ac import ACs
 from . import blocks
 from . import pt
+from . import timers
+from .dispatcher import Dispatcher
+from .scheduler import UpdateScheduler
 
 CLIENT_PROTOCOL_VERSION = '1.1'
 SOCKET_TIMEOUT = 10  # seconds
 UPDATE_PERIOD = 1  # seconds
+RECV_SIZE = 16384  # bytes read from socket at once
+CONNECT_DELAY = 0.25  # seconds, delay of parallel connection attempt
+
+# Reconnect: first attempt within RECONNECT_FIRST, then RECONNECT_MIN doubled
+# with each failed attempt up to RECONNECT_MAX; delays are randomized by
+# +-RECONNECT_JITTER, so clients do not reconnect to restarted server at once.
+RECONNECT_FIRST = 0.2  # seconds
+RECONNECT_MIN = 1.0  # seconds
+RECONNECT_MAX = 30.0  # seconds
+RECONNECT_JITTER = 0.5
+
+# 'time_to_operational': seconds from last disconnect to resync done
+stats: Dict[str, float] = {'connects': 0, 'connect_failures': 0, 'time_to_operational': 0.0}
 
 panel_socket: Optional[socket.socket] = None
+# Used instead of socket when client is not socket-based (see `ac.aio`)
+transport: Optional[Callable[[bytes], None]] = None
+# Set e.g. `panel_client.dispatcher = Dispatcher(workers=8)` to run AC &
+# block handlers in thread pool instead of socket thread. Handlers of single
+# AC run serially, all block change handlers run serially in 'blocks' lane.
+dispatcher: Optional[Dispatcher] = None
+# Spreads 'on_update' calls of ACs across UPDATE_PERIOD (read by `init`)
+update_scheduler = UpdateScheduler(UPDATE_PERIOD)
+_send_lock = threading.Lock()
+_outbuf = bytearray()  # messages waiting for socket write (guarded by _send_lock)
+_wakeup_r, _wakeup_w = socket.socketpair()  # wakes up `_listen` select
+_wakeup_r.setblocking(False)
+_wakeup_w.setblocking(False)
+_attempt = 0  # reconnect attempts since last operational connection
+_hello_received = False  # in current connection
+_disconnected_at: Optional[float] = None
+_last_good: Optional['Endpoint'] = None  # endpoint of last connection
 
 
 class DisconnectedError(Exception):
@@ -30,77 +69,171 @@ class OutdatedVersionError(Exception):
     pass
 
 
+class _RecvBuffer:
+    """
+    Receive buffer of a single connection. Keeps incomplete line between
+    `recv` calls and decodes UTF-8 incrementally, so multi-byte characters
+    split between chunks are decoded correctly.
+    """
+
+    def __init__(self) -> None:
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.pending = ''
+
+    def feed(self, data: bytes) -> List[str]:
+        """Add received data, return all complete lines (without EOL)."""
+        self.pending += self.decoder.decode(data)
+        if '\n' not in self.pending:
+            return []
+        *lines, self.pending = self.pending.split('\n')
+        return [line.replace('\r', '') for line in lines]
+
+
 def _listen(sock: socket.socket) -> None:
-    next_update = datetime.datetime.now() + \
-                  datetime.timedelta(seconds=UPDATE_PERIOD)
+    buffer = _RecvBuffer()
 
     try:
         while True:
             readable, writable, exceptional = select.select(
-                [sock], [], [sock], UPDATE_PERIOD
+                [sock, _wakeup_r], [sock] if _outbuf else [], [sock], _timeout()
             )
 
             if sock in exceptional:
                 raise DisconnectedError('Socket exception!')
 
             if sock in readable:
-                _handle_ready_read(sock)
-
-            if datetime.datetime.now() > next_update:
-                next_update = datetime.datetime.now() + \
-                              datetime.timedelta(seconds=UPDATE_PERIOD)
-                for ac_ in ACs.values():
-                    try:
-                        ac_.on_update()
-                    except Exception:
-                        traceback.print_exc()
-                events.call(events.evs_on_update)
+                _handle_ready_read(sock, buffer)
+
+            if _wakeup_r in readable:
+                _drain_wakeup()
+
+            timers.run_due()
+            update_scheduler.run_due(dispatch)
+            _flush(sock)
 
     except Exception as e:
         logging.error(f'Connection error: {e}')
 
 
-def _handle_ready_read(sock: socket.socket) -> None:
-    data = sock.recv(2048)
+def _timeout() -> float:
+    timeout = update_scheduler.timeout()
+    timers_timeout = timers.timeout()
+    if timers_timeout is not None:
+        timeout = min(timeout, timers_timeout)
+    return timeout
+
+
+def _wake() -> None:
+    try:
+        _wakeup_w.send(b'\0')
+    except BlockingIOError:
+        pass  # already woken up
+
+
+def _drain_wakeup() -> None:
+    try:
+        while _wakeup_r.recv(4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def _sleep(seconds: float) -> None:
+    """Sleep, but keep firing timers."""
+    deadline = time.monotonic() + seconds
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        timers_timeout = timers.timeout()
+        if timers_timeout is not None:
+            remaining = min(remaining, timers_timeout)
+        select.select([_wakeup_r], [], [], remaining)
+        _drain_wakeup()
+        timers.run_due()
+
+
+def dispatch(key: str, func: Callable[..., Any], *args: Any) -> None:
+    """Run event handler `func` in `dispatcher` (in lane `key`) or now."""
+    if dispatcher is None:
+        events.run(func, *args)
+    else:
+        dispatcher.submit(key, func, *args)
+
+
+def _handle_ready_read(sock: socket.socket, buffer: _RecvBuffer) -> None:
+    data = sock.recv(RECV_SIZE)
     if not data:
         raise DisconnectedError('Disconnected from server!')
 
-    recv = data.decode('utf-8').replace('\r', '')
+    for line in buffer.feed(data):
+        logging.debug(f'> {line.strip()}')
+        try:
+            _process_message(sock, line.strip())
+        except Exception as e:
+            logging.warning(f'Message processing error: {str(e)}!')
+            traceback.print_exc()
 
-    if '\n' not in recv:
-        return
 
-    q = deque(recv.splitlines(keepends=True))
+def send(message: str, sock: Optional[socket.socket] = None) -> None:
+    """
+    Send message to server. Messages are queued and written to socket
+    together once per loop iteration.
+    """
+    logging.debug(f'< {message}')
+    data = (message + '\n').encode('UTF-8')
+
+    if panel_socket is None and sock is None:
+        if transport is not None:
+            transport(data)
+        else:
+            logging.warning(f'Not connected, message not sent: {message}')
+        return
 
-    while q:
-        item = q.popleft()
-        logging.debug(f'> {item.strip()}')
+    with _send_lock:
+        wake = not _outbuf
+        _outbuf.extend(data)
+    if wake:
+        _wake()  # send could be called from another thread
 
-        if item.endswith('\n'):
-            try:
-                _process_message(sock, item.strip())
-            except Exception as e:
-                logging.warning(f'Message processing error: {str(e)}!')
-                traceback.print_exc()
 
+def send_items(*items: str) -> None:
+    """Serialize `items` (escape if needed) and send them as single message."""
+    send(message_parser.serialize(items))
 
-def send(message: str, sock: Optional[socket.socket] = None) -> None:
-    """Send message to server."""
-    if sock is None:
-        global panel_socket
-        sock = panel_socket
-    assert sock is not None
 
-    try:
-        logging.debug(f'< {message}')
-        sock.send((message + '\n').encode('UTF-8'))
+def _flush(sock: socket.socket) -> None:
+    """Write as much of queued data as socket accepts."""
+    with _send_lock:
+        if not _outbuf:
+            return
+        try:
+            sent = sock.send(_outbuf)
+        except (BlockingIOError, InterruptedError):
+            return
+        del _outbuf[:sent]
 
-    except Exception as e:
-        logging.error(f'Connection exception: {e}')
 
+def _process_message(sock: Optional[socket.socket], message: str) -> None:
+    if not metrics.enabled:
+        _handle_message(message_parser.parse(message, ';'))
+        return
 
-def _process_message(sock: socket.socket, message: str) -> None:
+    start = time.perf_counter()
     parsed = message_parser.parse(message, ';')
+    _handle_message(parsed)
+    metrics.observe(_message_type(parsed), time.perf_counter() - start)
+
+
+def _message_type(parsed: List[str]) -> str:
+    if len(parsed) < 2:
+        return 'message.INVALID'
+    if parsed[1] == 'AC' and len(parsed) > 3:
+        return f'message.AC.{parsed[3]}'
+    return f'message.{parsed[1]}'
+
+
+def _handle_message(parsed: List[str]) -> None:
     if len(parsed) < 2:
         return
 
@@ -113,62 +246,199 @@ def _process_message(sock: socket.socket, message: str) -> None:
     elif (parsed[1] == 'PING' and len(parsed) > 2 and
           parsed[2].upper() == 'REQ-RESP'):
         if len(parsed) > 3:
-            send(f'-;PONG;{parsed[3]}', sock)
+            send_items('-', 'PONG', parsed[3])
         else:
-            send('-;PONG', sock)
+            send_items('-', 'PONG')
     elif (len(parsed) >= 4 and parsed[0] == '-' and parsed[1] == 'AC'):
         if parsed[2] != '-':
-            ACs[parsed[2]].on_message(parsed)
+            dispatch(parsed[2], ACs[parsed[2]].on_message, parsed)
         elif parsed[2] == '-' and parsed[3].upper() == 'BLOCKS':
             blocks.on_message(parsed)
 
 
 def _process_hello(parsed: List[str]) -> None:
+    global _hello_received
     version = float(parsed[2])
     logging.info(f'Server version: {version}')
+    _hello_received = True
 
     if version < 1:
         raise OutdatedVersionError(f'Outdated version of server protocol: {version}!')
 
-    for ac_ in ACs.values():
+    for id_, ac_ in list(ACs.items()):
         try:
-            ac_.on_connect()
+            dispatch(id_, ac_.on_connect)
         except Exception:
             traceback.print_exc()
-    events.call(events.evs_on_connect)
+    dispatch('events', events.call, events.evs_on_connect)
     blocks._send_all_registrations()
+    blocks.resync(_on_operational)
 
 
-def _connect(server: str, port: int) -> socket.socket:
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(SOCKET_TIMEOUT)
+def _on_operational() -> None:
+    global _disconnected_at
+    if _disconnected_at is None:
+        return
+    duration = time.monotonic() - _disconnected_at
+    _disconnected_at = None
+    stats['time_to_operational'] = duration
+    logging.info(f'Operational {duration:.2f} s after disconnect')
+    if metrics.enabled:
+        metrics.observe('reconnect.time_to_operational', duration)
+
+
+def reconnect_delay(attempt: int) -> float:
+    """Return delay before reconnect attempt number `attempt` (from 0)."""
+    if attempt == 0:
+        return random.uniform(0, RECONNECT_FIRST)
+    delay = min(RECONNECT_MIN * 2.0**(attempt-1), RECONNECT_MAX)
+    return delay * random.uniform(1 - RECONNECT_JITTER, 1 + RECONNECT_JITTER)
+
+
+def _next_delay() -> float:
+    global _attempt, _hello_received
+    if _hello_received:
+        _attempt = 0  # last connection was operational
+    _hello_received = False
+    delay = reconnect_delay(_attempt)
+    _attempt += 1
+    logging.info(f'Reconnecting in {delay:.1f} s')
+    return delay
+
+
+def _on_disconnect() -> None:
+    global _disconnected_at
+    if _disconnected_at is None:
+        _disconnected_at = time.monotonic()
+    for id_, ac_ in list(ACs.items()):
+        try:
+            dispatch(id_, ac_.on_disconnect)
+        except Exception:
+            traceback.print_exc()
+    dispatch('events', events.call, events.evs_on_disconnect)
+    blocks._on_disconnect()
+
+
+def _set_keepalive(sock: socket.socket) -> None:
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
     sock.setsockopt(socket.SOL_TCP, socket.TCP_KEEPIDLE, 1)
     sock.setsockopt(socket.SOL_TCP, socket.TCP_KEEPINTVL, 1)
     sock.setsockopt(socket.SOL_TCP, socket.TCP_KEEPCNT, 5)
-    sock.connect((server, port))
-    sock.setblocking(False)
 
-    return sock
+
+class Endpoint(NamedTuple):
+    """Panel server `host`:`port` & PT server port on the same host."""
+    host: str
+    port: int = 5896
+    pt_port: int = pt.PORT
 
 
-def init(server: str, port: int, app_name: str = '') -> None:
+def endpoints(server: Union[str, Sequence[Any]], port: int = 5896) -> List[Endpoint]:
+    """Return list of endpoints from `server` (host or list of endpoints/tuples)."""
+    if isinstance(server, str):
+        return [Endpoint(server, port, pt.PORT)]
+    return [Endpoint(*endpoint) for endpoint in server]
+
+
+def _addresses(endpoints_: Sequence[Endpoint]) -> List[Tuple[Endpoint, int, Any]]:
+    """Resolve endpoints to (endpoint, family, address), IPv6 & IPv4 interleaved."""
+    result: List[Tuple[Endpoint, int, Any]] = []
+    for endpoint in endpoints_:
+        try:
+            infos = socket.getaddrinfo(endpoint.host, endpoint.port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            logging.warning(f'{endpoint.host}: {e}')
+            continue
+        ipv6 = [(info[0], info[4]) for info in infos if info[0] == socket.AF_INET6]
+        other = [(info[0], info[4]) for info in infos if info[0] != socket.AF_INET6]
+        for pair in itertools.zip_longest(ipv6, other):
+            result.extend((endpoint, *address) for address in pair if address is not None)
+    return result
+
+
+def _connect(endpoints_: Sequence[Endpoint]) -> Tuple[socket.socket, Endpoint]:
+    """
+    Connect to first responsive endpoint (Happy Eyeballs): connection
+    attempts are started CONNECT_DELAY apart (or immediately after previous
+    attempt failed) and run in parallel, first established connection wins.
+    Last successful endpoint is tried first.
+    """
+    global _last_good
+    last_good = _last_good
+    if last_good is not None and last_good in endpoints_:
+        endpoints_ = [last_good, *(e for e in endpoints_ if e != last_good)]
+    candidates = _addresses(endpoints_)
+    pending: Dict[socket.socket, Endpoint] = {}
+    error: OSError = OSError(f'Unable to resolve {", ".join(e.host for e in endpoints_)}')
+    now = time.monotonic()
+    deadline = now + SOCKET_TIMEOUT
+    next_attempt = now
+
+    try:
+        while candidates or pending:
+            now = time.monotonic()
+            if now >= deadline:
+                raise socket.timeout('Connection timed out')
+
+            if candidates and (now >= next_attempt or not pending):
+                endpoint, family, address = candidates.pop(0)
+                next_attempt = now + CONNECT_DELAY
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                err = sock.connect_ex(address)
+                if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    pending[sock] = endpoint
+                else:
+                    sock.close()
+                    error = OSError(err, f'{os.strerror(err)}: {address}')
+                    next_attempt = now
+                continue
+
+            wait_until = min(next_attempt, deadline) if candidates else deadline
+            _, writable, _ = select.select([], list(pending), [], max(wait_until - now, 0))
+            for sock in writable:
+                endpoint = pending.pop(sock)
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0:
+                    _set_keepalive(sock)
+                    _last_good = endpoint
+                    return sock, endpoint
+                sock.close()
+                error = OSError(err, f'{os.strerror(err)}: {endpoint.host}:{endpoint.port}')
+                next_attempt = now  # start next attempt immediately
+        raise error
+    finally:
+        for sock in pending:
+            sock.close()
+
+
+def init(server: Union[str, Sequence[Any]], port: int = 5896, app_name: str = '') -> None:
     """
     Infinite function to open & keep open socket with Panel server.
     Tries to restore connection in case of connection loss.
+
+    `server` is a host or ordered list of endpoints (`Endpoint` or tuples
+    (host, port[, pt_port])) of main & standby servers, see `_connect`.
     """
     global panel_socket
-    pt.server = server
+    endpoints_ = endpoints(server, port)
+    update_scheduler.period = UPDATE_PERIOD
+    timers.wakeup = _wake
 
     while True:
         connected = False
         try:
-            logging.info(f'Initializing connection to {server}:{port}...')
-            sock = _connect(server, port)
+            logging.info('Initializing connection to '
+                         f'{", ".join(f"{e.host}:{e.port}" for e in endpoints_)}...')
+            sock, endpoint = _connect(endpoints_)
+            pt.server, pt.PORT = endpoint.host, endpoint.pt_port
             connected = True
+            stats['connects'] += 1
             logging.info('Socket opened')
             panel_socket = sock
-            send(f'-;HELLO;{CLIENT_PROTOCOL_VERSION};{app_name}', sock)
+            with _send_lock:
+                _outbuf.clear()
+            send_items('-', 'HELLO', CLIENT_PROTOCOL_VERSION, app_name)
             _listen(sock)
         except DisconnectedError:
             logging.info('Disconnected from server')
@@ -176,13 +446,10 @@ def init(server: str, port: int, app_name: str = '') -> None:
             logging.info('Unable to connect to server')
         except OSError as e:
             logging.info(e)
-            time.sleep(9)
 
         if connected:
-            for ac_ in ACs.values():
-                try:
-                    ac_.on_disconnect()
-                except Exception:
-                    traceback.print_exc()
-            events.call(events.evs_on_disconnect)
-        time.sleep(1)
+            panel_socket = None
+            _on_disconnect()
+        else:
+            stats['connect_failures'] += 1
+        _sleep(_next_delay())
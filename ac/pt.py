@@ -1,41 +1,154 @@
 """
 Utils for interaction with PT server. These functions should not be used by
 user. User should interact through instance of AC.
+
+PT requests are sent over a bounded pool of persistent HTTP/1.1 connections,
+so consecutive requests do not pay TCP connect/teardown.
 """
 
-import urllib.request
+import asyncio
+import concurrent.futures
+import http.client
 import json
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple, Iterable, Optional
 import base64
 import logging
+import threading
+import time
+
+from . import metrics
 
 server = ''
 PORT = 5823
+TIMEOUT = 10  # seconds
+POOL_SIZE = 4  # maximum number of idle connections kept open
+
+# 'created': new TCP connections opened, 'reused': requests sent over an idle
+# pooled connection, 'reconnects': requests retried after stale connection
+stats: Dict[str, int] = {'created': 0, 'reused': 0, 'reconnects': 0}
+
+_pool: List[Tuple[Tuple[str, int], http.client.HTTPConnection]] = []
+_pool_lock = threading.Lock()
+_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+# Errors caused by server closing idle keep-alive connection
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
 
 
 class PTHttpException(Exception):
     pass
 
 
+def _acquire() -> Tuple[http.client.HTTPConnection, bool]:
+    """Return (connection, reused)."""
+    address = (server, PORT)
+    with _pool_lock:
+        while _pool:
+            conn_address, conn = _pool.pop()
+            if conn_address == address:
+                stats['reused'] += 1
+                return conn, True
+            conn.close()  # server changed
+        stats['created'] += 1
+    return http.client.HTTPConnection(server, PORT, timeout=TIMEOUT), False
+
+
+def _release(conn: http.client.HTTPConnection) -> None:
+    with _pool_lock:
+        if len(_pool) < POOL_SIZE:
+            _pool.append(((conn.host, conn.port), conn))
+            return
+    conn.close()
+
+
+def close_all() -> None:
+    """Close all idle pooled connections."""
+    with _pool_lock:
+        conns = [conn for _, conn in _pool]
+        _pool.clear()
+    for conn in conns:
+        conn.close()
+
+
+def pool_size() -> int:
+    """Return number of idle connections in the pool."""
+    with _pool_lock:
+        return len(_pool)
+
+
+def _request(conn: http.client.HTTPConnection, path: str, method: str,
+             body: bytes, headers: Dict[str, str]) -> Tuple[int, bytes, bool]:
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, data, response.will_close
+
+
 def _send(path: str, method: str, req_data: Dict[str, Any],
           user: str = '', password: str = '') -> Dict[str, Any]:
     if not path.startswith('/'):
         path = '/' + path
+    if not metrics.enabled:
+        return _send_request(path, method, req_data, user, password)
+
+    name = f'pt.{method} {metrics.path_template(path)}'
+    start = time.perf_counter()
+    try:
+        return _send_request(path, method, req_data, user, password)
+    except Exception:
+        metrics.inc(name + ' errors')
+        raise
+    finally:
+        metrics.observe(name, time.perf_counter() - start)
+
+
+def _send_request(path: str, method: str, req_data: Dict[str, Any],
+                  user: str, password: str) -> Dict[str, Any]:
 
     base64string = base64.b64encode(('%s:%s' % (user, password)).
                                     encode('utf-8')).decode('utf-8')
-    req = urllib.request.Request(
-        f'http://{server}:{PORT}{path}',
-        headers={
-            'Authorization': f'Basic {base64string}',
-            'Content-type': 'application/json',
-        },
-        method=method,
-        data=json.dumps(req_data).encode('utf-8'),
-    )
-    with urllib.request.urlopen(req) as response:
-        data = response.read().decode('utf-8')
-    return json.loads(data)  # type: ignore
+    headers = {
+        'Authorization': f'Basic {base64string}',
+        'Content-type': 'application/json',
+        'Connection': 'keep-alive',
+    }
+    body = json.dumps(req_data).encode('utf-8')
+
+    conn, reused = _acquire()
+    try:
+        try:
+            status, data, will_close = _request(conn, path, method, body, headers)
+        except _STALE_ERRORS:
+            conn.close()
+            if not reused:
+                raise
+            # Pooled connection was closed by server meanwhile, retry once
+            stats['reconnects'] += 1
+            status, data, will_close = _request(conn, path, method, body, headers)
+    except Exception:
+        conn.close()
+        raise
+
+    if will_close:
+        conn.close()
+    else:
+        _release(conn)
+
+    try:
+        response: Dict[str, Any] = json.loads(data.decode('utf-8'))
+    except ValueError:
+        raise PTHttpException(f'HTTP {status}: invalid response for {method} {path}')
+    if status >= 400:
+        if isinstance(response, dict) and 'errors' in response:
+            raise PTHttpException(response['errors'])
+        raise PTHttpException(f'HTTP {status}: {method} {path}')
+    return response
 
 
 def get(path: str) -> Dict[str, Any]:
@@ -53,3 +166,47 @@ def put(path: str, req_data: Dict[str, Any], username: str,
     if 'errors' in response:
         raise PTHttpException(response['errors'])
     return response
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=POOL_SIZE, thread_name_prefix='pt',
+        )
+    return _executor
+
+
+def get_many(paths: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    GET multiple paths concurrently (at most POOL_SIZE requests at once).
+    Responses are returned in order of `paths`.
+    """
+    paths = list(paths)
+    if len(paths) <= 1:
+        return [get(path) for path in paths]
+    return list(_get_executor().map(get, paths))
+
+
+def get_later(path: str) -> 'concurrent.futures.Future[Dict[str, Any]]':
+    """Start GET in background, return its future."""
+    return _get_executor().submit(get, path)
+
+
+def put_later(path: str, req_data: Dict[str, Any], username: str,
+              password: str) -> 'concurrent.futures.Future[Dict[str, Any]]':
+    """Start PUT in background, return its future."""
+    return _get_executor().submit(put, path, req_data, username, password)
+
+
+async def get_async(path: str) -> Dict[str, Any]:
+    """`get` variant which does not block event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, get, path)
+
+
+async def put_async(path: str, req_data: Dict[str, Any], username: str,
+                    password: str) -> Dict[str, Any]:
+    """`put` variant which does not block event loop."""
+    return await asyncio.get_running_loop().run_in_executor(
+        None, put, path, req_data, username, password
+    )
@@ -0,0 +1,137 @@
+"""
+Scheduler of periodic `on_update` calls of ACs.
+
+Calls are spread evenly across the update period (each AC has its own
+phase), so many ACs in single process do not run their `on_update` in one
+burst. Time spent in each `on_update` is measured against a time budget.
+"""
+
+import heapq
+import logging
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple, Any
+
+from . import events
+from . import metrics
+from .ac import ACs, AC
+
+_GOLDEN = 0.6180339887498949  # low-discrepancy phase sequence step
+
+_EVENTS_KEY = ''  # heap key of global `on_update` events
+
+
+class UpdateScheduler:
+    """
+    `period`: on_update period of running (or unregistered) AC.
+    `idle_period`: on_update period of registered AC which is not running.
+    `budget`: on_update time budget of single AC, by default fair share of
+      the period (period / number of ACs).
+    """
+
+    def __init__(self, period: float = 1, idle_period: float = 10,
+                 budget: Optional[float] = None) -> None:
+        self.period = period
+        self.idle_period = idle_period
+        self.budget = budget
+        self.stats: Dict[str, float] = {
+            'calls': 0, 'skipped': 0, 'over_budget': 0, 'late': 0,
+            'tick_overruns': 0,
+        }
+        self.ac_stats: Dict[str, Dict[str, float]] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._scheduled: Dict[str, float] = {}  # key -> due time
+        self._last_run: Dict[str, float] = {}
+        self._phases = 0
+        self._tick_start = time.monotonic()
+        self._tick_work = 0.0
+
+    def timeout(self) -> float:
+        """Return time (seconds) to the next scheduled call."""
+        self._sync()
+        if not self._heap:
+            return self.period
+        return max(self._heap[0][0] - time.monotonic(), 0)
+
+    def run_due(self, dispatch: Callable[..., None]) -> None:
+        """Run all due `on_update`s via `dispatch(key, func, *args)`."""
+        self._sync()
+        now = time.monotonic()
+        while self._heap and self._heap[0][0] <= now:
+            due, key = heapq.heappop(self._heap)
+            if self._scheduled.get(key) != due:
+                continue
+            if key == _EVENTS_KEY:
+                dispatch('events', self._run, key, events.call, events.evs_on_update)
+            elif key not in ACs:
+                del self._scheduled[key]
+                self.ac_stats.pop(key, None)
+                self._last_run.pop(key, None)
+                continue
+            elif self._active(ACs[key]) or \
+                    now - self._last_run.get(key, -self.idle_period) >= self.idle_period:
+                self._last_run[key] = now
+                dispatch(key, self._run, key, ACs[key].on_update)
+            else:
+                self.stats['skipped'] += 1
+
+            if now - due > self.period:
+                self.stats['late'] += 1
+            next_due = due + self.period
+            if next_due <= now:
+                next_due = now + self.period * self._next_phase()  # no burst after stall
+            self._push(key, next_due)
+
+        if now - self._tick_start >= self.period:
+            if self._tick_work > self.period:
+                self.stats['tick_overruns'] += 1
+                logging.warning(f'on_update tick overrun: {self._tick_work:.3f} s of work '
+                                f'in {self.period} s period')
+            self._tick_start = now
+            self._tick_work = 0.0
+
+    def _run(self, key: str, func: Callable[..., None], *args: Any) -> None:
+        start = time.monotonic()
+        try:
+            events.run(func, *args)
+        except Exception:
+            traceback.print_exc()
+        duration = time.monotonic() - start
+        if metrics.enabled:
+            metrics.observe(f'on_update.{key or "events"}', duration)
+
+        self.stats['calls'] += 1
+        self._tick_work += duration
+        stats = self.ac_stats.setdefault(
+            key, {'calls': 0, 'total': 0.0, 'max': 0.0, 'over_budget': 0}
+        )
+        stats['calls'] += 1
+        stats['total'] += duration
+        stats['max'] = max(stats['max'], duration)
+        budget = self.budget if self.budget is not None else \
+            self.period / max(len(self._scheduled), 1)
+        if duration > budget:
+            stats['over_budget'] += 1
+            self.stats['over_budget'] += 1
+
+    def _active(self, ac_: AC) -> bool:
+        return not ac_.registered or ac_.running()
+
+    def _next_phase(self) -> float:
+        self._phases += 1
+        return (self._phases * _GOLDEN) % 1
+
+    def _push(self, key: str, due: float) -> None:
+        self._scheduled[key] = due
+        heapq.heappush(self._heap, (due, key))
+
+    def _sync(self) -> None:
+        """Schedule newly added ACs (removed ACs are dropped in `run_due`)."""
+        if len(self._scheduled) == len(ACs) + 1:
+            return
+        now = time.monotonic()
+        if _EVENTS_KEY not in self._scheduled:
+            self._push(_EVENTS_KEY, now + self.period)
+        for key in list(ACs.keys()):
+            if key not in self._scheduled:
+                self._push(key, now + self.period * self._next_phase())
@@ -0,0 +1,90 @@
+"""
+Timers executed by panel client loop.
+
+Example:
+    timer = ac.call_later(5, self.on_timeout)
+    ...
+    timer.cancel()
+
+Callbacks are called in panel client thread (or in asyncio loop of
+`ac.aio`) and could be `async def`. Panel client loop sleeps until the
+nearest timer, so timers fire on time without polling.
+
+Callbacks touching an AC should run in its dispatcher lane, so they are
+serialized with the AC's handlers:
+    ac.call_later(5, panel_client.dispatch, self.id, self.on_timeout)
+"""
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from typing import Any, Callable, List, Optional
+
+from . import events
+
+_heap: List['Timer'] = []
+_lock = threading.Lock()
+_seq = itertools.count()
+
+# Called when new nearest timer is added to wake up the loop (set by loop)
+wakeup: Optional[Callable[[], None]] = None
+
+
+class Timer:
+    def __init__(self, when: float, callback: Callable[..., Any],
+                 args: Any) -> None:
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self._seq = next(_seq)
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def __lt__(self, other: 'Timer') -> bool:
+        return (self.when, self._seq) < (other.when, other._seq)
+
+
+def call_at(when: float, callback: Callable[..., Any], *args: Any) -> Timer:
+    """Call `callback(*args)` at time `when` (`time.monotonic()` clock)."""
+    timer = Timer(when, callback, args)
+    with _lock:
+        heapq.heappush(_heap, timer)
+        nearest = _heap[0] is timer
+    if nearest and wakeup is not None:
+        wakeup()
+    return timer
+
+
+def call_later(delay: float, callback: Callable[..., Any], *args: Any) -> Timer:
+    """Call `callback(*args)` after `delay` seconds."""
+    return call_at(time.monotonic() + delay, callback, *args)
+
+
+def timeout() -> Optional[float]:
+    """Return time (seconds) to the nearest timer or None if no timer."""
+    with _lock:
+        while _heap and _heap[0].cancelled:
+            heapq.heappop(_heap)
+        if not _heap:
+            return None
+        return max(_heap[0].when - time.monotonic(), 0)
+
+
+def run_due() -> None:
+    """Call callbacks of all expired timers."""
+    now = time.monotonic()
+    while True:
+        with _lock:
+            if not _heap or _heap[0].when > now:
+                return
+            timer = heapq.heappop(_heap)
+        if timer.cancelled:
+            continue
+        try:
+            events.run(timer.callback, *timer.args)
+        except Exception:
+            traceback.print_exc()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmark of ac.message_parser.parse on typical PanelServer messages.
+
+Usage: python3 bench/bench_parser.py
+"""
+
+from typing import Dict
+
+from common import measure
+from ac import message_parser
+
+NUMBER = 20000
+
+MESSAGES = {
+    'change': '-;AC;-;BLOCKS;CHANGE;1234',
+    'ping': '-;PING;REQ-RESP;{15}',
+    'control': '-;AC;5000;CONTROL;START',
+    'state': '-;AC;5000;CONTROL;STATE;{' +
+             ','.join('{Postavena JC Klb S%d > Klb L%d.}' % (i, i) for i in range(50)) + '}',
+    'list': '-;AC;-;BLOCKS;LIST;{' + ','.join('{%d}' % i for i in range(500)) + '}',
+}
+
+
+# Typical traffic: mostly CHANGEs & PINGs, sometimes AC control
+MIX = ['change'] * 16 + ['ping'] * 2 + ['control'] + ['state']
+
+
+def bench() -> Dict[str, float]:
+    """Return seconds per parse of each message & of message of the mix."""
+    results = {
+        name: measure(lambda: message_parser.parse(message, ';'), NUMBER)
+        for name, message in MESSAGES.items()
+    }
+    mix = [MESSAGES[name] for name in MIX]
+    results['mix'] = measure(
+        lambda: [message_parser.parse(message, ';') for message in mix], NUMBER // len(mix)
+    ) / len(mix)
+    return results
+
+
+def run() -> None:
+    for name, seconds in bench().items():
+        size = len(MESSAGES[name]) if name in MESSAGES else 0
+        print(f'{name:10} {size:6} B {seconds * 1e6:10.2f} us')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,18 @@
+"""Helpers shared by benchmarks."""
+
+import os
+import sys
+import timeit
+from typing import Callable
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# After directory of benchmarks; mypy finds them via MYPYPATH (see Makefile)
+sys.path.insert(1, ROOT)  # ac, utils
+sys.path.insert(2, os.path.join(ROOT, 'test'))  # mock_server
+
+REPEAT = 3
+
+
+def measure(func: Callable[[], object], number: int, repeat: int = REPEAT) -> float:
+    """Return best time of single `func` call (seconds) of `repeat` runs."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of panel_client._process_message dispatch and of
+blocks._call_change with PT stub (in-process and over HTTP to
+test/mock_server.py).
+
+Usage: python3 bench/dispatch.py
+"""
+
+from typing import Any, Dict, List
+
+from common import measure
+import ac
+import ac.blocks
+from ac import AC, ACs, panel_client, pt
+import mock_server
+
+NUMBER = 2000
+AC_COUNTS = [1, 100]
+HANDLER_COUNTS = [1, 100]
+
+
+class BenchAC(AC):
+    def on_resume(self) -> None:
+        pass
+
+
+def _stub_get(blocks: Dict[int, ac.Block]) -> Any:
+    def get(path: str) -> Dict[str, Any]:
+        return {'block': blocks[int(path.split('/')[2].split('?')[0])]}
+    return get
+
+
+def _clear() -> None:
+    for acn in ACs.values():
+        ac.blocks.unsubscribe(acn)
+    ACs.clear()
+
+
+def _setup(acs: int, handlers: int) -> List[str]:
+    _clear()
+    for i in range(acs):
+        ACs[str(i)] = BenchAC(str(i))
+        ACs[str(i)].state = ac.State.PAUSED
+    for i in range(handlers):
+        ac.blocks.subscribe(ACs[str(i % acs)], lambda block: None, 1)
+    return [f'-;AC;{i};CONTROL;RESUME' for i in range(acs)] + ['-;AC;-;BLOCKS;CHANGE;1']
+
+
+def bench() -> Dict[str, float]:
+    results = {}
+    get, transport = pt.get, panel_client.transport
+    panel_client.transport = lambda data: None
+    pt.get = _stub_get({1: {'id': 1, 'name': 'Kolej 1', 'blockState': {'state': 'free'}}})
+    try:
+        for acs in AC_COUNTS:
+            for handlers in HANDLER_COUNTS:
+                messages = _setup(acs, handlers)
+
+                def process() -> None:
+                    for message in messages:
+                        panel_client._process_message(None, message)
+
+                results[f'process_message.acs{acs}.handlers{handlers}'] = measure(
+                    process, max(NUMBER // len(messages), 10),
+                ) / len(messages)
+
+        _setup(1, 1)
+        results['call_change.stub'] = measure(lambda: ac.blocks._call_change('1'), NUMBER)
+        pt.get = get
+
+        server = mock_server.MockServer()
+        server.start()
+        server_, port = pt.server, pt.PORT
+        pt.server, pt.PORT = '127.0.0.1', server.pt_port
+        try:
+            results['call_change.http'] = measure(
+                lambda: ac.blocks._call_change('1'), NUMBER // 10
+            )
+        finally:
+            pt.server, pt.PORT = server_, port
+            pt.close_all()
+            server.stop()
+    finally:
+        pt.get, panel_client.transport = get, transport
+        _clear()
+    return results
+
+
+def run() -> None:
+    for name, seconds in bench().items():
+        print(f'{name:40} {seconds * 1e6:10.2f} us')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""
+Run all benchmarks, print results as JSON (seconds per operation).
+
+Usage:
+  python3 bench/run.py [-o results.json] [--compare baseline.json]
+                       [--threshold 1.2] [benchmark ...]
+
+With --compare, benchmarks slower than `threshold` x baseline are reported
+and exit code is 1.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import platform
+import subprocess
+import sys
+from typing import Any, Callable, Dict, Iterable
+
+import bench_parser
+import common
+import dispatch
+import startup
+import update
+
+BENCHMARKS: Dict[str, Callable[[], Dict[str, float]]] = {
+    'parser': bench_parser.bench,
+    'dispatch': dispatch.bench,
+    'startup': startup.bench,
+    'update': update.bench,
+}
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=common.ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run(names: Iterable[str]) -> Dict[str, Any]:
+    results: Dict[str, float] = {}
+    for name in names:
+        for key, seconds in BENCHMARKS[name]().items():
+            results[f'{name}.{key}'] = seconds
+    return {
+        'commit': _commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """Print comparison, return True when no regression found."""
+    ok = True
+    for name, seconds in current['results'].items():
+        base = baseline['results'].get(name)
+        if not base:
+            continue
+        ratio = seconds / base
+        regression = ratio > threshold
+        ok = ok and not regression
+        print(f'{name:50} {ratio:6.2f}x{"  REGRESSION" if regression else ""}',
+              file=sys.stderr)
+    return ok
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description='Run benchmarks.')
+    argparser.add_argument('benchmarks', nargs='*', help=', '.join(BENCHMARKS.keys()))
+    argparser.add_argument('-o', '--output', help='write results to file')
+    argparser.add_argument('--compare', metavar='BASELINE', help='compare with results file')
+    argparser.add_argument('--threshold', type=float, default=1.2)
+    options = argparser.parse_args()
+    unknown = set(options.benchmarks) - BENCHMARKS.keys()
+    if unknown:
+        argparser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+
+    logging.basicConfig(level=logging.ERROR)
+    current = run(options.benchmarks or BENCHMARKS.keys())
+    data = json.dumps(current, indent=2)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as file:
+            file.write(data + '\n')
+    else:
+        print(data)
+
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if not compare(current, baseline, options.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of DanceAC.on_start (resolving names of steps' JCs & blocks) against
+test/mock_server.py.
+
+Usage: python3 bench/startup.py
+"""
+
+from typing import Dict
+
+from common import measure
+from ac import pt
+from utils import names
+from utils.dancer import DanceAC, Step, StepJC, StepWaitForBlock, track_is_occupied
+import mock_server
+
+NUMBER = 20
+TRACKS = 500
+STEPS = 100
+
+
+def _reset() -> None:
+    """Drop cached name -> id index."""
+    names.invalidate()
+
+
+def bench() -> Dict[str, float]:
+    server = mock_server.MockServer(tracks=TRACKS)
+    server.start()
+    server_, port = pt.server, pt.PORT
+    pt.server, pt.PORT = '127.0.0.1', server.pt_port
+
+    steps: Dict[int, Step] = {}
+    for i in range(1, STEPS+1, 2):
+        steps[i] = StepJC(f'JC {i} > {i+2}')
+        steps[i+1] = StepWaitForBlock(f'Kolej {i}', track_is_occupied)
+    acn = DanceAC('1', '', steps)
+    acn.registered = True
+
+    def cold() -> None:
+        _reset()
+        acn.on_start()
+
+    try:
+        return {
+            f'dance_on_start.steps{STEPS}.cold': measure(cold, NUMBER),
+            f'dance_on_start.steps{STEPS}.warm': measure(acn.on_start, NUMBER),
+        }
+    finally:
+        _reset()
+        pt.server, pt.PORT = server_, port
+        pt.close_all()
+        server.stop()
+
+
+def run() -> None:
+    for name, seconds in bench().items():
+        print(f'{name:40} {seconds * 1e3:10.3f} ms')
+
+
+if __name__ == '__main__':
+    run()
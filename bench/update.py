@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of on_update tick (scheduler.UpdateScheduler.run_due) with many ACs.
+
+Usage: python3 bench/update.py
+"""
+
+import time
+from typing import Any, Callable, Dict
+
+import common  # noqa: F401 (sys.path)
+from ac import AC, ACs, State
+from ac.scheduler import UpdateScheduler
+
+NUMBER = 20
+AC_COUNTS = [10, 1000]
+
+
+def _dispatch(key: str, func: Callable[..., None], *args: Any) -> None:
+    func(*args)
+
+
+def bench() -> Dict[str, float]:
+    results = {}
+    try:
+        for count in AC_COUNTS:
+            ACs.clear()
+            for i in range(count):
+                ACs[str(i)] = AC(str(i))
+                ACs[str(i)].registered = True
+                ACs[str(i)].state = State.RUNNING
+            scheduler = UpdateScheduler()
+            scheduler.run_due(_dispatch)
+            best = float('inf')
+            for _ in range(NUMBER):
+                # Make all ACs due at once (worst case tick)
+                scheduler._heap = [(0.0, key) for key in scheduler._scheduled]
+                scheduler._scheduled = dict.fromkeys(scheduler._scheduled, 0.0)
+                start = time.perf_counter()
+                scheduler.run_due(_dispatch)
+                best = min(best, time.perf_counter() - start)
+            results[f'on_update_tick.acs{count}'] = best
+    finally:
+        ACs.clear()
+    return results
+
+
+def run() -> None:
+    for name, seconds in bench().items():
+        print(f'{name:40} {seconds * 1e3:10.3f} ms')
+
+
+if __name__ == '__main__':
+    run()
@@ -20,11 +20,8 @@ from docopt import docopt
 from typing import Any, Dict, List
 
 import ac
-import ac.blocks
 from ac import ACs, AC
-import utils.blocks
-
-JC = Dict[str, Any]
+from utils.jc import JC, JCActivator, JCReadiness
 
 
 class JCAC(AC):
@@ -37,6 +34,9 @@ class JCAC(AC):
         AC.__init__(self, id_, password)
         self.to_process = to_process
         self.jcs_remaining: Dict[int, JC] = {}
+        self.readiness = JCReadiness(self, self.on_jcs_ready)
+        self.activator = JCActivator(self, self.on_jc_result, self.on_jc_error,
+                                     {'ab': True})
 
     def on_start(self) -> None:
         logging.info('Start')
@@ -44,15 +44,30 @@ class JCAC(AC):
         self.statestr = ''
 
         self.filter_done_jcs()
-        self.process_free_jcs()
+        self.readiness.clear()
+        self.activator.cancel()
+        if self.jcs_remaining:
+            self.readiness.add(self.jcs_remaining.values())  # calls on_jcs_ready
+        else:
+            self.check_done()
 
-        for jc in self.jcs_remaining.values():
-            ac.blocks.register(jc['tracks'])
+    def on_stop(self) -> None:
+        self.readiness.clear()
+        self.activator.cancel()
 
     def on_resume(self) -> None:
         self.set_color(0xFFFF00)
         self.on_start()
 
+    def on_jcs_ready(self, jcs: List[JC]) -> None:
+        if self.running():
+            self.process_jcs(jcs)
+
+    def check_done(self) -> None:
+        if not self.jcs_remaining:
+            self.done()
+            logging.info('All JCs processed.')
+
     def filter_done_jcs(self) -> None:
         remaining = {}
         for jc in self.jcs_remaining.values():
@@ -63,52 +78,40 @@ class JCAC(AC):
         self.statestr_send()
         self.jcs_remaining = remaining
 
-    def process_free_jcs(self) -> None:
-        self.process_jcs(free_jcs(list(self.jcs_remaining.values())))
-
-        if not self.jcs_remaining:
-            self.done()
-            logging.info('All JCs processed.')
-
     def process_jcs(self, jcs: List[JC]) -> None:
         for jc in jcs:
             logging.info(f'Processing JC {jc["name"]}...')
-            result = self.pt_put(f'/jc/{jc["id"]}/state', {'ab': True})
-            if result['success']:
-                self.statestr_add(f'Postavena JC {jc["name"]}.')
-                logging.info('ok')
-                ac.blocks.unregister(jc['tracks'])
-            else:
-                self.statestr_add(f'Nelze postavit JC {jc["name"]}.')
-                self.disp_error(f'Nelze postavit JC {jc["name"]}')
-                logging.error(f'Unable to process JC {jc["name"]}: ' +
-                              str(result['barriers']))
-                self.set_color(0xFF0000)
-
-            del self.jcs_remaining[jc['id']]
-            self.statestr_send()
+            self.readiness.remove(jc['id'])
+        self.activator.activate(jcs)  # results in on_jc_result & on_jc_error
+
+    def on_jc_result(self, jc: JC, result: Dict[str, Any]) -> None:
+        if result['success']:
+            self.statestr_add(f'Postavena JC {jc["name"]}.')
+            logging.info(f'JC {jc["name"]} ok')
+        else:
+            self.statestr_add(f'Nelze postavit JC {jc["name"]}.')
+            self.disp_error(f'Nelze postavit JC {jc["name"]}')
+            logging.error(f'Unable to process JC {jc["name"]}: ' +
+                          str(result['barriers']))
+            self.set_color(0xFF0000)
+        self.jc_processed(jc)
+
+    def on_jc_error(self, jc: JC, error: Exception) -> None:
+        self.statestr_add(f'Chyba při stavění JC {jc["name"]}.')
+        self.disp_error(f'Chyba při stavění JC {jc["name"]}')
+        logging.error(f'Unable to process JC {jc["name"]}: {error}')
+        self.set_color(0xFF0000)
+        self.jc_processed(jc)
+
+    def jc_processed(self, jc: JC) -> None:
+        self.jcs_remaining.pop(jc['id'], None)
+        self.statestr_send()
+        self.check_done()
 
 
 def jcs(ids: List[int]) -> Dict[int, JC]:
-    return {jc_id: ac.pt.get(f'/jc/{jc_id}?state=true')['jc'] for jc_id in ids}
-
-
-def free_jcs(jcs: List[JC]) -> List[JC]:
-    result = []
-    for jc in jcs:
-        free = all([utils.blocks.state(track_id)['state'] == 'free'
-                    for track_id in jc['tracks']])
-        if free:
-            result.append(jc)
-
-    return result
-
-
-@ac.blocks.on_block_change()
-def _on_block_change(block: ac.Block) -> None:
-    for ac_ in ACs.values():
-        if isinstance(ac_, JCAC):
-            ac_.process_free_jcs()
+    responses = ac.pt.get_many(f'/jc/{jc_id}?state=true' for jc_id in ids)
+    return {jc_id: response['jc'] for jc_id, response in zip(ids, responses)}
 
 
 if __name__ == '__main__':
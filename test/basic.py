@@ -16,7 +16,6 @@ AC_ID = '5000'
 def _on_connect() -> None:
     logging.info('connected')
     ACs[AC_ID].register('loskarlos')
-    ac.blocks.register([5, 6, 7])
 
 
 class MyAC(AC):
@@ -53,4 +52,5 @@ def _on_block_change_(block: ac.Block) -> None:
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     ACs[AC_ID] = MyAC(AC_ID)
+    ac.blocks.register([5, 6, 7])  # kept across reconnects
     ac.init(HOSTNAME, PORT)
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+
+"""
+Local stand-in of hJOPserver for offline testing and benchmarks.
+
+Speaks PanelServer TCP protocol (HELLO, PING REQ-RESP, AC LOGIN/LOGOUT/
+CONTROL, BLOCKS REGISTER/UNREGISTER/CHANGE) and serves PT HTTP endpoints
+used by `ac.pt`, `utils` and `examples` (/blocks, /blockState, /jc) on
+generated layout of tracks & JCs. It could generate CHANGE storms: state of
+random (or scripted) blocks is changed at configured rate and CHANGE is sent
+to clients which registered the block.
+
+Latency of client is measured as time from sending CHANGE of a block to the
+next PT request of the block's state.
+
+Usage:
+  python3 test/mock_server.py [--port 5896] [--pt-port 5823] [--tracks 100]
+                              [--start AC_ID] [--storm RATE] [--duration S]
+                              [--script FILE]
+
+Script file contains lines `<time from start> <block id> <state>`.
+
+Run client against it:
+  python3 examples/autojc.py -s 127.0.0.1 -p 5896 <ac_id> <password> ...
+"""
+
+import argparse
+import http.server
+import json
+import logging
+import os
+import random
+import re
+import socket
+import socketserver
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ac import message_parser  # noqa: E402
+
+Block = Dict[str, Any]
+JC = Dict[str, Any]
+
+PING_PERIOD = 5  # seconds, 0 = no pings
+
+
+def layout(tracks: int = 100, jc_length: int = 3) -> Tuple[Dict[int, Block], Dict[int, JC]]:
+    """Generate line of `tracks` tracks and JCs over `jc_length` tracks each."""
+    blocks = {
+        i: {'id': i, 'name': f'Kolej {i}', 'type': 'track',
+            'blockState': {'state': 'free'}}
+        for i in range(1, tracks+1)
+    }
+    jcs = {}
+    for i in range(1, tracks - jc_length + 2):
+        jcs[i] = {
+            'id': i, 'name': f'JC {i} > {i+jc_length-1}', 'type': 'VC',
+            'tracks': list(range(i, i+jc_length)), 'state': {'active': False},
+        }
+    return blocks, jcs
+
+
+class _Client:
+    """Connected panel client."""
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.blocks: Set[int] = set()
+        self.acs: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def send(self, *lines: str) -> None:
+        data = ''.join(line + '\n' for line in lines).encode('utf-8')
+        with self._lock:
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                pass  # disconnected, handler cleans up
+
+
+class MockServer:
+    """
+    `password`: accepted AC password (any password if None).
+    Ports 0 = any free port, see `panel_port` & `pt_port` after `start`.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', panel_port: int = 0,
+                 pt_port: int = 0, tracks: int = 100,
+                 password: Optional[str] = None) -> None:
+        self.blocks, self.jcs = layout(tracks)
+        self.password = password
+        self.acs: Dict[str, Dict[str, Any]] = {}  # AC id -> state of AC
+        self.stats: Dict[str, int] = {
+            'connections': 0, 'messages': 0, 'changes': 0, 'pt_requests': 0,
+        }
+        self.latencies: List[float] = []  # CHANGE -> PT GET of the block
+        self._clients: List[_Client] = []
+        self._pt_connections: Set[socket.socket] = set()  # keep-alive connections
+        self._lock = threading.Lock()
+        self._change_sent: Dict[int, float] = {}
+        self._ping_id = 0
+
+        mock = self
+
+        class PanelHandler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                mock._handle_panel(self.request, self.rfile)
+
+        class PTHandler(_PTHandler):
+            server_mock = mock
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._panel = socketserver.ThreadingTCPServer((host, panel_port), PanelHandler)
+        self._panel.daemon_threads = True
+        self._pt = http.server.ThreadingHTTPServer((host, pt_port), PTHandler)
+        self._pt.daemon_threads = True
+        self.panel_port: int = self._panel.server_address[1]
+        self.pt_port: int = self._pt.server_address[1]
+        self._threads: List[threading.Thread] = []
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        for target in (self._panel.serve_forever, self._pt.serve_forever, self._ping):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._panel.shutdown()
+        self._pt.shutdown()
+        with self._lock:
+            socks = [client.sock for client in self._clients] + list(self._pt_connections)
+        for sock in socks:
+            # Pooled PT connections of clients must not talk to stopped server
+            try:
+                sock.shutdown(socket.SHUT_RDWR)  # socket is also used by reader
+            except OSError:
+                pass
+            sock.close()
+        self._panel.server_close()
+        self._pt.server_close()
+
+    # Panel server ------------------------------------------------------------
+
+    def _handle_panel(self, sock: socket.socket, rfile: Any) -> None:
+        client = _Client(sock)
+        with self._lock:
+            self._clients.append(client)
+            self.stats['connections'] += 1
+        try:
+            for raw in rfile:
+                line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+                if line:
+                    self._process(client, message_parser.parse(line, ';'))
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._clients.remove(client)
+            for ac_id in client.acs:
+                self.acs.pop(ac_id, None)
+
+    def _process(self, client: _Client, parsed: List[str]) -> None:
+        self.stats['messages'] += 1
+        if len(parsed) < 2:
+            return
+        command = parsed[1].upper()
+        if command == 'HELLO':
+            client.send('-;HELLO;1.1')
+        elif command == 'AC' and len(parsed) >= 4:
+            if parsed[2] == '-':
+                self._process_blocks(client, parsed)
+            else:
+                self._process_ac(client, parsed[2], parsed)
+
+    def _process_ac(self, client: _Client, ac_id: str, parsed: List[str]) -> None:
+        command = parsed[3].upper()
+        if command == 'LOGIN':
+            if self.password is not None and parsed[4:5] != [self.password]:
+                client.send(message_parser.serialize(
+                    ['-', 'AC', ac_id, 'AUTH', 'nok', '3', 'Neplatné heslo']
+                ))
+                return
+            client.acs.add(ac_id)
+            self.acs[ac_id] = {'state': 'stopped', 'statestr': [], 'color': '', 'client': client}
+            client.send(f'-;AC;{ac_id};AUTH;ok')
+        elif command == 'LOGOUT':
+            client.acs.discard(ac_id)
+            self.acs.pop(ac_id, None)
+            client.send(f'-;AC;{ac_id};AUTH;logout')
+        elif command == 'CONTROL' and len(parsed) >= 5 and ac_id in self.acs:
+            state = self.acs[ac_id]
+            control = parsed[4].upper()
+            if control == 'STATE':
+                state['statestr'] = message_parser.parse(parsed[5], ',') \
+                    if len(parsed) > 5 else []
+            elif control == 'FG-COLOR':
+                state['color'] = parsed[5] if len(parsed) > 5 else ''
+            elif control == 'DONE':
+                state['state'] = 'done'
+                logging.info(f'AC {ac_id} done')
+            elif control == 'ERROR':
+                logging.info(f'AC {ac_id} error: {parsed[6:]}')
+
+    def _process_blocks(self, client: _Client, parsed: List[str]) -> None:
+        if len(parsed) < 6:
+            return
+        command = parsed[4].upper()
+        ids = message_parser.parse(parsed[5], ',')
+        if command == 'REGISTER':
+            for id_ in ids:
+                if id_.isdigit() and int(id_) in self.blocks:
+                    client.blocks.add(int(id_))
+                else:
+                    client.send(message_parser.serialize(
+                        ['-', 'AC', '-', 'BLOCKS', 'REGISTER', id_, 'ERR', 'Neexistující blok']
+                    ))
+        elif command == 'UNREGISTER':
+            client.blocks.difference_update(int(id_) for id_ in ids if id_.isdigit())
+
+    def _ping(self) -> None:
+        while PING_PERIOD and not self._stopped.wait(PING_PERIOD):
+            self._ping_id += 1
+            for client in self.clients():
+                client.send(f'-;PING;REQ-RESP;{self._ping_id}')
+
+    def clients(self) -> List[_Client]:
+        with self._lock:
+            return list(self._clients)
+
+    def control(self, ac_id: str, command: str) -> None:
+        """Send CONTROL `command` (START, STOP, PAUSE, RESUME) to AC."""
+        state = self.acs[ac_id]
+        state['state'] = {'START': 'running', 'RESUME': 'running', 'STOP': 'stopped',
+                          'PAUSE': 'paused'}[command.upper()]
+        state['client'].send(f'-;AC;{ac_id};CONTROL;{command.upper()}')
+
+    # Blocks & changes --------------------------------------------------------
+
+    def set_state(self, block_id: int, state: str) -> None:
+        """Change state of block & notify clients which registered it."""
+        self.set_states([(block_id, state)])
+
+    def set_states(self, changes: List[Tuple[int, str]]) -> None:
+        """Change states of blocks, notifications are sent in single write."""
+        now = time.perf_counter()
+        for block_id, state in changes:
+            self.blocks[block_id]['blockState']['state'] = state
+            self._change_sent.setdefault(block_id, now)
+        for client in self.clients():
+            lines = [f'-;AC;-;BLOCKS;CHANGE;{block_id}'
+                     for block_id, _ in changes if block_id in client.blocks]
+            if lines:
+                self.stats['changes'] += len(lines)
+                client.send(*lines)
+
+    def registered(self) -> Set[int]:
+        return set().union(*(client.blocks for client in self.clients()))
+
+    def storm(self, rate: float, duration: float, ids: Optional[List[int]] = None,
+              seed: Optional[int] = None) -> int:
+        """
+        Toggle state of random blocks (from `ids` or registered blocks) `rate`
+        times per second for `duration` seconds. Return number of changes.
+        """
+        rnd = random.Random(seed)
+        start = time.monotonic()
+        done = 0
+        while not self._stopped.is_set():
+            elapsed = time.monotonic() - start
+            if elapsed >= duration:
+                break
+            due = int(elapsed * rate) - done  # changes behind schedule
+            candidates = ids or sorted(self.registered()) or list(self.blocks.keys())
+            if due > 0:
+                changes = []
+                for _ in range(due):
+                    block_id = rnd.choice(candidates)
+                    free = self.blocks[block_id]['blockState']['state'] == 'free'
+                    changes.append((block_id, 'occupied' if free else 'free'))
+                self.set_states(changes)
+                done += due
+            time.sleep(min(max(1 / rate, 0.001), 0.05))
+        return done
+
+    def run_script(self, lines: List[str]) -> None:
+        """Run lines `<time> <block id> <state>` (time from now in seconds)."""
+        start = time.monotonic()
+        for line in lines:
+            if not line.strip() or line.startswith('#'):
+                continue
+            when, block_id, state = line.split()
+            delay = start + float(when) - time.monotonic()
+            if delay > 0 and self._stopped.wait(delay):
+                return
+            self.set_state(int(block_id), state)
+
+    def _on_state_read(self, block_id: int) -> None:
+        sent = self._change_sent.pop(block_id, None)
+        if sent is not None:
+            self.latencies.append(time.perf_counter() - sent)
+
+    # PT server ---------------------------------------------------------------
+
+    def pt(self, method: str, path: str, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        self.stats['pt_requests'] += 1
+        path, _, query = path.partition('?')
+        state = 'state=true' in query
+        parts = [part for part in path.split('/') if part]
+
+        if parts == ['blocks'] and method == 'GET':
+            if state:
+                for block_id in self.blocks:
+                    self._on_state_read(block_id)
+            return 200, {'blocks': [self._block(block, state) for block in self.blocks.values()]}
+        if parts[:1] == ['blocks'] and len(parts) == 2 and method == 'GET':
+            block = self._find(self.blocks, parts[1])
+            if block is None:
+                return 404, _error('Blok neexistuje')
+            if state:
+                self._on_state_read(block['id'])
+            return 200, {'block': self._block(block, state)}
+        if parts[:1] == ['blockState'] and len(parts) == 2:
+            block = self._find(self.blocks, parts[1])
+            if block is None:
+                return 404, _error('Blok neexistuje')
+            if method == 'PUT':
+                new_state = body.get('blockState', {}).get('state')
+                if new_state is not None:
+                    self.set_state(block['id'], new_state)
+            else:
+                self._on_state_read(block['id'])
+            return 200, {'blockState': block['blockState']}
+        if parts == ['jc'] and method == 'GET':
+            return 200, {'jc': [self._jc(jc, state) for jc in self.jcs.values()]}
+        if parts[:1] == ['jc'] and len(parts) in (2, 3):
+            jc = self._find(self.jcs, parts[1])
+            if jc is None:
+                return 404, _error('Jízdní cesta neexistuje')
+            if len(parts) == 2 and method == 'GET':
+                return 200, {'jc': self._jc(jc, state)}
+            if len(parts) == 3 and parts[2] == 'state' and method == 'PUT':
+                return 200, self._activate(jc)
+        return 404, _error(f'Neznámý požadavek {method} {path}')
+
+    def _activate(self, jc: JC) -> Dict[str, Any]:
+        barriers = [
+            {'type': 'occupied', 'block': {'id': track, 'name': self.blocks[track]['name']}}
+            for track in jc['tracks']
+            if self.blocks[track]['blockState']['state'] != 'free'
+        ]
+        if barriers:
+            return {'success': False, 'barriers': barriers}
+        jc['state']['active'] = True
+        return {'success': True, 'barriers': []}
+
+    @staticmethod
+    def _find(items: Dict[int, Dict[str, Any]], id_: str) -> Optional[Dict[str, Any]]:
+        return items.get(int(id_)) if id_.isdigit() else None
+
+    @staticmethod
+    def _block(block: Block, state: bool) -> Block:
+        if state:
+            return {**block, 'blockState': dict(block['blockState'])}
+        return {key: value for key, value in block.items() if key != 'blockState'}
+
+    @staticmethod
+    def _jc(jc: JC, state: bool) -> JC:
+        if state:
+            return {**jc, 'state': dict(jc['state'])}
+        return {key: value for key, value in jc.items() if key != 'state'}
+
+
+def _error(title: str) -> Dict[str, Any]:
+    return {'errors': [{'status': '404', 'title': title}]}
+
+
+class _PTHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True  # headers & body are written separately
+    server_mock: MockServer
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server_mock._lock:
+            self.server_mock._pt_connections.add(self.connection)
+
+    def finish(self) -> None:
+        with self.server_mock._lock:
+            self.server_mock._pt_connections.discard(self.connection)
+        try:
+            super().finish()
+        except OSError:
+            pass  # closed by `stop`
+
+    def do_GET(self) -> None:
+        self._respond('GET')
+
+    def do_PUT(self) -> None:
+        self._respond('PUT')
+
+    def _respond(self, method: str) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = {}
+        status, response = self.server_mock.pt(method, self.path, body)
+        data = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.debug(format % args)
+
+
+def _id_list(value: str) -> List[int]:
+    return [int(id_) for id_ in re.split('[, ]+', value) if id_]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Local stand-in of hJOPserver.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5896, help='panel server port')
+    parser.add_argument('--pt-port', type=int, default=5823, help='PT server port')
+    parser.add_argument('--tracks', type=int, default=100)
+    parser.add_argument('--password', help='accepted AC password (default any)')
+    parser.add_argument('--start', action='append', default=[], metavar='AC_ID',
+                        help='start AC after login')
+    parser.add_argument('--storm', type=float, metavar='RATE', help='changes per second')
+    parser.add_argument('--duration', type=float, default=10, help='storm duration (s)')
+    parser.add_argument('--blocks', type=_id_list, help='storm blocks, e.g. "1,2,3"')
+    parser.add_argument('--script', help='file with lines `<time> <block id> <state>`')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    server = MockServer(args.host, args.port, args.pt_port, args.tracks, args.password)
+    server.start()
+    logging.info(f'Panel server on {args.host}:{server.panel_port}, '
+                 f'PT server on {args.host}:{server.pt_port}')
+
+    try:
+        for ac_id in args.start:
+            while ac_id not in server.acs:
+                time.sleep(0.1)
+            server.control(ac_id, 'START')
+            logging.info(f'AC {ac_id} started')
+
+        if args.script:
+            with open(args.script, encoding='utf-8') as file:
+                server.run_script(file.readlines())
+        if args.storm:
+            start = time.monotonic()
+            count = server.storm(args.storm, args.duration, args.blocks)
+            elapsed = time.monotonic() - start
+            logging.info(f'Storm: {count} changes in {elapsed:.1f} s')
+            time.sleep(1)  # late reactions of client
+            if server.latencies:
+                latencies = sorted(server.latencies)
+                logging.info(
+                    f'Client reaction latency: n={len(latencies)} '
+                    f'p50={latencies[len(latencies)//2]*1000:.2f} ms '
+                    f'p99={latencies[int(len(latencies)*0.99)]*1000:.2f} ms'
+                )
+        if args.script or args.storm:
+            logging.info(f'Stats: {server.stats}')
+        else:
+            threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
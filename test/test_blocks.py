@@ -0,0 +1,109 @@
+"""
+Tests of ac.blocks registrations (reference counting, batching, replay)
+and of re-reading states fetched before REGISTER, no server is needed.
+Run via pytest (python3 -m pytest test/test_blocks.py).
+"""
+
+import time
+from typing import Any, Callable, Iterable, Iterator, List
+
+import pytest
+
+from ac import AC, blocks, panel_client, pt, timers
+
+
+def reset() -> None:
+    for timer in [blocks._flush_timer, *blocks._pending_changes.values()]:
+        if timer is not None:
+            timer.cancel()
+    blocks._flush_timer = None
+    blocks._pending_changes.clear()
+    blocks.events.clear()
+    blocks.global_events.clear()
+    blocks.subscriptions.clear()
+    blocks._ac_subscriptions.clear()
+    blocks._refcounts.clear()
+    blocks._server_registered.clear()
+    blocks._pending_registrations.clear()
+    blocks._registered.clear()
+    blocks.invalidate()
+
+
+Sent = Callable[[], List[str]]
+
+
+@pytest.fixture
+def sent(monkeypatch: pytest.MonkeyPatch) -> Iterator[Sent]:
+    """Return function running pending timers & returning BLOCKS messages sent so far."""
+    raw: List[bytes] = []
+    monkeypatch.setattr(panel_client, 'transport', raw.append)
+    reset()
+
+    def messages() -> List[str]:
+        timers.run_due()
+        return [m.decode().strip() for m in raw if b';BLOCKS;' in m]
+
+    yield messages
+    reset()
+
+
+def test_refcount(sent: Sent) -> None:
+    blocks.register([1])
+    blocks.register([1])
+    assert sent() == ['-;AC;-;BLOCKS;REGISTER;1']
+    blocks.unregister([1])
+    assert sent() == ['-;AC;-;BLOCKS;REGISTER;1']
+    blocks.unregister([1])
+    assert sent()[-1] == '-;AC;-;BLOCKS;UNREGISTER;1'
+    assert blocks.registered() == set()
+
+
+def test_batching(sent: Sent) -> None:
+    blocks.register([3, 1])
+    blocks.register([2])
+    blocks.register([4])
+    blocks.unregister([4])  # undone in the same tick
+    assert sent() == ['-;AC;-;BLOCKS;REGISTER;{1,2,3}']
+
+
+def test_replay(sent: Sent) -> None:
+    blocks.register([5, 6])
+    blocks.unregister([6])
+    sent()
+    blocks._on_disconnect()
+    blocks._send_all_registrations()
+    assert sent()[-1] == '-;AC;-;BLOCKS;REGISTER;5'
+
+
+def test_decorator_does_not_pin(sent: Sent) -> None:
+    @blocks.on_block_change(12)
+    def handler(block: blocks.Block) -> None:
+        pass
+
+    assert blocks.registered() == set()
+    blocks.register([12])
+    blocks.unregister([12])
+    sent()
+    blocks.register([12])
+    sent()
+    blocks.unregister([12])
+    assert sent() == ['-;AC;-;BLOCKS;REGISTER;12', '-;AC;-;BLOCKS;UNREGISTER;12']
+
+
+def test_recheck_after_register(sent: Sent, monkeypatch: pytest.MonkeyPatch) -> None:
+    def get_many(paths: Iterable[str]) -> List[Any]:
+        return [{'block': {'id': 7, 'blockState': {'state': 'occupied'}}} for _ in paths]
+
+    monkeypatch.setattr(pt, 'get_many', get_many)
+    monkeypatch.setattr(blocks, '_seeded', True)
+    blocks._store({'id': 7, 'blockState': {'state': 'free'}})  # read before REGISTER
+    changes: List[str] = []
+    blocks.subscribe(AC('test'), lambda block: changes.append(block['blockState']['state']), 7)
+    assert sent() == ['-;AC;-;BLOCKS;REGISTER;7']
+
+    deadline = time.monotonic() + 5
+    while not changes and time.monotonic() < deadline:
+        timers.run_due()
+        time.sleep(0.01)
+    assert changes == ['occupied']
+    assert blocks.get(7)['blockState']['state'] == 'occupied'
@@ -0,0 +1,78 @@
+"""
+Tests of utils.dancer.StepGraphAC (joins & loops) with stub steps,
+no server is needed. Run via pytest (python3 -m pytest test/test_dancer.py).
+"""
+
+from typing import Dict, Iterator, List
+
+import pytest
+
+from ac import AC, State, panel_client
+from utils import dancer, names
+from utils.dancer import Node, StepGraphAC
+
+
+class StepStub(dancer.Step):
+    """Step logging its runs, finishes immediately unless `hold`."""
+
+    def __init__(self, name: str, log: List[str], hold: bool = False) -> None:
+        self.name = name
+        self.log = log
+        self.hold = hold
+
+    def update(self, acn: AC) -> None:
+        assert isinstance(acn, dancer.DanceAC)
+        self.log.append(self.name)
+        if not self.hold:
+            acn.step_done(self)
+
+
+@pytest.fixture
+def sent(monkeypatch: pytest.MonkeyPatch) -> Iterator[List[bytes]]:
+    messages: List[bytes] = []
+    monkeypatch.setattr(panel_client, 'transport', messages.append)
+    monkeypatch.setattr(names, 'warm', lambda: None)
+    yield messages
+
+
+def start(nodes: Dict[dancer.NodeId, Node]) -> StepGraphAC:
+    acn = StepGraphAC('test', '', nodes)
+    acn.registered = True
+    acn.state = State.RUNNING
+    acn.on_start()
+    return acn
+
+
+def is_done(sent: List[bytes]) -> bool:
+    return b'-;AC;test;CONTROL;DONE\n' in sent
+
+
+def test_loop_body_with_outer_input(sent: List[bytes]) -> None:
+    log: List[str] = []
+    start({
+        'X': Node(StepStub('X', log)),
+        'A': Node(StepStub('A', log)),
+        'B': Node(StepStub('B', log), after=['A', 'X']),
+        'C': Node(StepStub('C', log), after=['B'], loop_to='A', loops=2),
+    })
+    assert log == ['X', 'A', 'B', 'C', 'A', 'B', 'C', 'A', 'B', 'C']
+    assert is_done(sent)
+
+
+def test_join_after_loop_body(sent: List[bytes]) -> None:
+    log: List[str] = []
+    e = StepStub('E', log, hold=True)
+    acn = start({
+        'A': Node(StepStub('A', log)),
+        'B': Node(StepStub('B', log), after=['A'], loop_to='A', loops=1),
+        'E': Node(e),
+        'D': Node(StepStub('D', log), after=['A', 'E']),
+    })
+    assert 'D' not in log
+    assert not is_done(sent)
+
+    e.hold = False
+    acn.on_update()
+    assert log.count('D') == 1
+    assert log.count('A') == 2
+    assert is_done(sent)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""
+Equivalence test of ac.message_parser.parse against the original
+character-by-character implementation on randomly generated messages.
+
+Run directly or via pytest (python3 -m pytest test/test_parser.py).
+"""
+
+import random
+import string
+from typing import List
+
+from ac import message_parser
+
+ITERATIONS = 20000
+SEED = 5896
+
+
+def parse_reference(data: str, separators: str) -> List[str]:
+    output: List[str] = []
+    item = ''
+    escaped_level = 0
+
+    for c in data:
+        if c == '{':
+            if escaped_level > 0:
+                item += c
+            escaped_level += 1
+
+        elif (c == '}') and (escaped_level > 0):
+            escaped_level -= 1
+            if escaped_level > 0:
+                item += c
+        else:
+            if (c in separators) and (escaped_level == 0):
+                output.append(item)
+                item = ''
+
+            else:
+                if (c not in separators) or (escaped_level > 0):
+                    item += c
+
+    if item != "":
+        output.append(item)
+
+    return output
+
+
+def random_message(rnd: random.Random) -> str:
+    alphabet = '{};,|' + 'ab-' + 'čř' + string.digits
+    weights = [4, 4, 6, 3, 1] + [3] * 3 + [1] * 2 + [1] * 10
+    return ''.join(rnd.choices(alphabet, weights, k=rnd.randint(0, 40)))
+
+
+def test_known_messages() -> None:
+    messages = [
+        '', ';', ';;', 'a;', ';a', '{}', '{};a', 'a;{}', '{{}}', '}', '}{',
+        '-;AC;5000;AUTH;ok',
+        '-;AC;-;BLOCKS;CHANGE;12',
+        '-;AC;5000;CONTROL;STATE;{{line 1},{line {2}},{}}',
+        '-;AC;5000;AUTH;nok;1;{chyba; s separátorem}',
+        'a{b;c}d;e', '{a', 'a}', '{a;b', 'a;b}', '{{a}b}c',
+    ]
+    for separators in [';', ',', ';,', '']:
+        for message in messages:
+            assert message_parser.parse(message, separators) == \
+                parse_reference(message, separators), (message, separators)
+
+
+def test_random_messages() -> None:
+    rnd = random.Random(SEED)
+    for _ in range(ITERATIONS):
+        message = random_message(rnd)
+        separators = rnd.choice([';', ',', ';,', '}', '{;', '|-'])
+        assert message_parser.parse(message, separators) == \
+            parse_reference(message, separators), (message, separators)
+
+
+def test_serialize_unbalanced() -> None:
+    items = ['x } y', 'a {', '}{', '{a;b}', 'c', '{{a} b']
+    assert message_parser.serialize(items) == '{x ) y};{a (};{)(};{{a;b}};c;{({a} b}'
+    assert message_parser.parse(message_parser.serialize(items), ';') == \
+        [message_parser.balance(item) for item in items]
+
+
+if __name__ == '__main__':
+    test_known_messages()
+    test_random_messages()
+    test_serialize_unbalanced()
+    print('ok')
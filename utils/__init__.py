@@ -1,4 +1,6 @@
 from . import blocks
 from . import dancer
+from . import jc
+from . import names
 
-__all__ = ['blocks', 'dancer']
+__all__ = ['blocks', 'dancer', 'jc', 'names']
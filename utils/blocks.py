@@ -1,4 +1,4 @@
-"""Blocks cache helper"""
+"""Blocks state helper, kept for compatibility, see `ac.blocks.state`."""
 
 from typing import Dict, Any
 
@@ -7,15 +7,7 @@ import ac.blocks
 
 
 Block = Dict[str, Any]
-blocks_state: Dict[int, Block] = {}
 
 
 def state(id_: int) -> Dict[str, Any]:
-    if id_ not in blocks_state:
-        blocks_state[id_] = ac.pt.get(f'/blockState/{id_}')['blockState']
-    return blocks_state[id_]
-
-
-@ac.blocks.on_block_change()
-def _on_block_change(block: ac.Block) -> None:
-    blocks_state[block['id']] = block['blockState']
+    return ac.blocks.state(id_)
@@ -1,12 +1,17 @@
 """Library for executing a user-defined predefined steps ("dance")."""
 
+import collections
+import concurrent.futures
 import logging
-from typing import Any, Dict, Optional, Callable
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple, Union
 import datetime
 
 import ac
 import ac.blocks
-from ac import ACs, AC
+import ac.panel_client
+import ac.pt
+from ac import AC
+from . import names
 
 JC = Dict[str, Any]
 
@@ -24,6 +29,24 @@ class Step:
     def on_start(self, acn: AC) -> None:
         pass
 
+    def prefetch(self, acn: AC) -> None:
+        """
+        Called before the step becomes active (see `DanceAC.PREFETCH_LOOKAHEAD`),
+        step should start fetching data it needs in background.
+        """
+        pass
+
+    def on_pause(self, acn: AC) -> None:
+        """
+        Called when AC is paused or disconnected, step should release server
+        registrations. `update` is called again when AC runs.
+        """
+        pass
+
+    def on_stop(self, acn: AC) -> None:
+        """Called when AC is stopped, step should release its resources."""
+        pass
+
     def disp_str(self) -> str:
         return ''
 
@@ -36,42 +59,58 @@ class StepJC(Step):
     """
     Process jc 'name'. If processed already, skip processing and continue.
     """
-    name_to_id: Dict[str, int] = {}
 
     def __init__(self, name: str, type_: str = 'VC') -> None:
         self.jc: Optional[JC] = None
         self.type = type_
         self.name = name
+        self._prefetched: Optional['concurrent.futures.Future[Dict[str, Any]]'] = None
 
     def update(self, acn: AC) -> None:
         assert isinstance(acn, DanceAC)
         if self.jc is None:
-            jcid = self.get_jc_id(self.name, acn)
-            self.jc = acn.pt_get(f'/jc/{jcid}?state=true')['jc']
-
-        if self.jc['state']['active']:
-            self.jc = None
-            acn.step_done()
-            return
+            path = f'/jc/{self.get_jc_id(self.name)}?state=true'
+            future, self._prefetched = self._prefetched, None
+            if future is not None:
+                try:
+                    jc = future.result()['jc']
+                except Exception as e:
+                    logging.warning(f'JC {self.name}: prefetch failed: {e}')
+                else:
+                    # Prefetched active state could be outdated, confirm
+                    if not jc['state']['active']:
+                        self.jc = jc
+            if self.jc is None:
+                self.jc = acn.pt_get(path)['jc']
+
+            if self.jc['state']['active']:
+                self.jc = None
+                acn.step_done(self)
+                return
 
         result = acn.pt_put(f'/jc/{self.jc["id"]}/state', {})
+        self.jc = None  # JC could be activated by someone else, check again
         if result['success']:
-            self.jc = None
-            acn.step_done()
+            acn.step_done(self)
 
     def on_start(self, acn: AC) -> None:
-        self.get_jc_id(self.name, acn)
-
-    def get_jc_id(self, name: str, acn: AC) -> int:
-        if not StepJC.name_to_id:
-            jcs = acn.pt_get('/jc')['jc']
-            StepJC.name_to_id = {
-                jc['name']: jc['id']
-                for jc in jcs if jc['type'] == self.type
-            }
-        if name not in StepJC.name_to_id.keys():
+        self.get_jc_id(self.name)
+
+    def prefetch(self, acn: AC) -> None:
+        if self.jc is None and self._prefetched is None:
+            self._prefetched = ac.pt.get_later(f'/jc/{self.get_jc_id(self.name)}?state=true')
+
+    def on_stop(self, acn: AC) -> None:
+        self.jc = None
+        if self._prefetched is not None:
+            self._prefetched.cancel()
+            self._prefetched = None
+
+    def get_jc_id(self, name: str) -> int:
+        jcid = names.jc_id(name, self.type)
+        if jcid is None:
             raise JCNotFoundException(f'Jízdní cesta {self.name} neexistuje!')
-        return StepJC.name_to_id[name]
+        return jcid
 
     def disp_str(self) -> str:
         return f'Stavění JC {self.name}'
@@ -82,15 +121,33 @@ class StepDelay(Step):
 
     def __init__(self, delay: datetime.timedelta) -> None:
         self.delay = delay
-        self.finish: Optional[datetime.datetime] = None
+        self.timer: Optional[ac.Timer] = None
+        self.expired = False
 
     def update(self, acn: AC) -> None:
         assert isinstance(acn, DanceAC)
-        if self.finish is None:
-            self.finish = datetime.datetime.now() + self.delay
-        if datetime.datetime.now() > self.finish:
-            self.finish = None
-            acn.step_done()
+        if self.expired:
+            self.expired = False
+            acn.step_done(self)
+        elif self.timer is None:
+            self.timer = ac.call_later(
+                self.delay.total_seconds(), ac.panel_client.dispatch, acn.id, self._expire, acn,
+            )
+
+    def _expire(self, acn: AC) -> None:
+        assert isinstance(acn, DanceAC)
+        if self.timer is None:
+            return  # stopped meanwhile
+        self.timer = None
+        self.expired = True
+        if acn.running() and acn.is_active(self):
+            acn.on_update()
+
+    def on_stop(self, acn: AC) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.expired = False
 
     def disp_str(self) -> str:
         return f'Čekání {self.delay}'
@@ -100,47 +157,110 @@ class BlockNotFoundException(DanceStartException):
     pass
 
 
-class StepWaitForBlock(Step):
-    """Wait for specific state of any block. See examples below."""
-    name_to_id: Dict[str, int] = {}
+BlockChecker = Callable[[ac.Block], bool]
+
+
+def block_checkers(conditions: Dict[str, BlockChecker]) -> Dict[int, BlockChecker]:
+    """Resolve block names of `conditions` to ids."""
+    checkers = {}
+    for name, checker in conditions.items():
+        blockid = names.block_id(name)
+        if blockid is None:
+            raise BlockNotFoundException(f"Blok {name} neexistuje!")
+        checkers[blockid] = checker
+    return checkers
 
-    def __init__(self, name: str, checker: Callable[[ac.Block], bool]) -> None:
-        self.name = name
-        self.checker = checker
-        self.block: Optional[ac.Block] = None
+
+def blocks_satisfy(checkers: Dict[int, BlockChecker], any_: bool = False) -> bool:
+    """Check states of blocks (from `ac.blocks` store, GET only unknown states)."""
+    blocks = ac.blocks.get_many(checkers.keys())
+    results = (checker(blocks[id_]) for id_, checker in checkers.items())
+    return any(results) if any_ else all(results)
+
+
+class StepWaitForBlocks(Step):
+    """
+    Wait for specific state of blocks: all conditions (or any of them when
+    `any_`) must hold. States are read from `ac.blocks` store, which is kept up
+    to date by subscription, so the step is completed directly from change of
+    a block. Subscription is released when AC is stopped, paused or
+    disconnected.
+
+    Example:
+    StepWaitForBlocks({'Klb K1': track_is_occupied, 'Klb K2': track_is_free})
+    """
+
+    def __init__(self, conditions: Dict[str, BlockChecker], any_: bool = False) -> None:
+        self.conditions = conditions
+        self.any = any_
+        self.checkers: Dict[int, BlockChecker] = {}  # block id -> checker
+        self.acn: Optional[AC] = None
+        self.subscribed = False
+        self.waiting = False
 
     def update(self, acn: AC) -> None:
         assert isinstance(acn, DanceAC)
-        if self.block is None:
-            blockid = self.get_block_id(self.name, acn)
-            self.block = acn.pt_get(f'/blocks/{blockid}?state=true')['block']
-            if self.checker(self.block):
-                self.block = None
-                acn.step_done()
-            else:
-                ac.blocks.register([self.block['id']])
+        if self.waiting:
+            return  # completed by `on_block_change`
+        if not self.checkers:
+            self.on_start(acn)
+        self._subscribe(acn)
+        if self._check():
+            self._done(acn)
+        else:
+            self.waiting = True
 
     def on_start(self, acn: AC) -> None:
-        self.get_block_id(self.name, acn)
+        self.checkers = block_checkers(self.conditions)
 
-    def on_block_change(self, acn: AC, block: ac.Block) -> None:
-        assert isinstance(acn, DanceAC)
-        if self.block is None or block['id'] != self.block['id']:
+    def prefetch(self, acn: AC) -> None:
+        # Block states are kept in store by CHANGEs before the step is active
+        if self.checkers:
+            self._subscribe(acn)
+
+    def on_pause(self, acn: AC) -> None:
+        self._release(acn)
+
+    def on_stop(self, acn: AC) -> None:
+        self._release(acn)
+
+    def on_block_change(self, block: ac.Block) -> None:
+        acn = self.acn
+        if not self.waiting or acn is None or not acn.running():
             return
-        if self.checker(block):
-            ac.blocks.unregister([self.block['id']])
-            self.block = None
-            acn.step_done()
-
-    def get_block_id(self, name: str, acn: AC) -> int:
-        if not StepWaitForBlock.name_to_id:
-            blocks = acn.pt_get('/blocks')['blocks']
-            StepWaitForBlock.name_to_id = {
-                block['name']: block['id'] for block in blocks
-            }
-        if name not in StepWaitForBlock.name_to_id.keys():
-            raise BlockNotFoundException(f"Blok {self.name} neexistuje!")
-        return StepWaitForBlock.name_to_id[name]
+        if block['id'] in self.checkers and self._check():
+            self._done(acn)
+
+    def _check(self) -> bool:
+        return blocks_satisfy(self.checkers, self.any)
+
+    def _done(self, acn: AC) -> None:
+        assert isinstance(acn, DanceAC)
+        self._release(acn)
+        acn.step_done(self)
+
+    def _subscribe(self, acn: AC) -> None:
+        if not self.subscribed:
+            self.acn = acn
+            ac.blocks.subscribe(acn, self.on_block_change, *self.checkers.keys())
+            self.subscribed = True
+
+    def _release(self, acn: AC) -> None:
+        self.waiting = False
+        if self.subscribed:
+            ac.blocks.unsubscribe(acn, self.on_block_change, *self.checkers.keys())
+            self.subscribed = False
+
+    def disp_str(self) -> str:
+        return f'Čekání na stav bloků {", ".join(self.conditions.keys())}'
+
+
+class StepWaitForBlock(StepWaitForBlocks):
+    """Wait for specific state of any block. See examples below."""
+
+    def __init__(self, name: str, checker: BlockChecker) -> None:
+        StepWaitForBlocks.__init__(self, {name: checker})
+        self.name = name
 
     def disp_str(self) -> str:
         return f'Čekání na stav bloku {self.name}'
@@ -153,6 +273,8 @@ def track_is_occupied(block: ac.Block) -> bool:
 class DanceAC(AC):
     """This AC executes predefined steps."""
 
+    PREFETCH_LOOKAHEAD = 2  # number of upcoming steps prefetched
+
     def __init__(self, id_: str, password: str,
                  steps: Dict[int, Step]) -> None:
         AC.__init__(self, id_, password)
@@ -161,6 +283,17 @@ class DanceAC(AC):
 
     def on_start(self) -> None:
         logging.info('Start')
+        if not self.start_steps():
+            return
+
+        self.stepi = 1
+        self.prefetch()
+        self.send_step()
+        self.on_update()
+
+    def start_steps(self) -> bool:
+        """Call `on_start` of all steps, report error & finish AC on failure."""
+        names.warm()  # all names are resolved by 2 requests
 
         for stepi, step in self.steps.items():
             try:
@@ -168,16 +301,26 @@ class DanceAC(AC):
             except DanceStartException as e:
                 self.disp_error(f'Krok {stepi}: '+str(e))
                 self.done()
-                return
-
-        self.stepi = 1
-        self.send_step()
-        self.on_update()
+                return False
+        return True
 
     def on_stop(self) -> None:
+        for step in self.steps.values():
+            step.on_stop(self)
         self.statestr = ''
         self.statestr_send()
 
+    def on_pause(self) -> None:
+        for step in self.steps.values():
+            step.on_pause(self)
+
+    def on_resume(self) -> None:
+        self.on_update()
+
+    def on_disconnect(self) -> None:
+        for step in self.steps.values():
+            step.on_pause(self)
+
     def on_update(self) -> None:
         AC.on_update(self)
         if not self.running():
@@ -189,13 +332,23 @@ class DanceAC(AC):
             logging.info('Done')
             self.done()
 
-    def step_done(self) -> None:
+    def is_active(self, step: Step) -> bool:
+        return self.steps.get(self.stepi) is step
+
+    def step_done(self, step: Optional[Step] = None) -> None:
         logging.info(f'Step {self.stepi} done, '
                      f'going to step {self.stepi+1}...')
         self.stepi += 1
+        self.prefetch()
         self.send_step()
         self.on_update()
 
+    def prefetch(self) -> None:
+        """Prefetch data of current step & PREFETCH_LOOKAHEAD next steps."""
+        for stepi in range(self.stepi, self.stepi + self.PREFETCH_LOOKAHEAD + 1):
+            if stepi in self.steps:
+                self.steps[stepi].prefetch(self)
+
     def send_step(self) -> None:
         if self.stepi in self.steps.keys():
             if self.running():
@@ -203,14 +356,263 @@ class DanceAC(AC):
                 self.statestr = f'Aktuální krok: {self.stepi}: {description}'
             self.statestr_send()
 
-    def on_block_change(self, block: ac.Block) -> None:
-        if (self.running() and
-                isinstance(self.steps[self.stepi], StepWaitForBlock)):
-            self.steps[self.stepi].on_block_change(self, block)  # type: ignore
 
+NodeId = Union[int, str]
+
+
+class Node:
+    """
+    Node of step graph (see `StepGraphAC`).
+
+    `after`: nodes which must be finished before the step starts (join).
+    `when`: block conditions (block name -> checker) evaluated when the node
+      is ready; node is skipped when not satisfied (conditional branch).
+      Node is skipped also when all its `after` nodes were skipped.
+    `loop_to`, `loop_while`, `loops`: when the step is done, nodes from
+      `loop_to` to this node are run again while `loop_while` conditions hold
+      (at most `loops` times, no limit if None).
+    """
+
+    def __init__(self, step: Step, after: Iterable[NodeId] = (),
+                 when: Optional[Dict[str, BlockChecker]] = None,
+                 loop_to: Optional[NodeId] = None,
+                 loop_while: Optional[Dict[str, BlockChecker]] = None,
+                 loops: Optional[int] = None) -> None:
+        self.step = step
+        self.after = list(after)
+        self.when = when
+        self.loop_to = loop_to
+        self.loop_while = loop_while
+        self.loops = loops
+
+
+class StepGraphAC(DanceAC):
+    """
+    This AC executes graph of steps: steps run in parallel as soon as steps
+    they depend on are finished.
+
+    Only steps whose inputs changed are advanced: finishing a step marks the
+    input finished in its successors and starts those which became ready.
+
+    Example:
+    StepGraphAC(id_, password, {
+        'jc1': Node(StepJC('Klb S1 > Klb PriblL')),
+        'jc2': Node(StepJC('Klb S2 > Klb K2')),
+        'wait': Node(StepWaitForBlock('Klb K1', track_is_occupied)),
+        'delay': Node(StepDelay(datetime.timedelta(seconds=5)),
+                      after=['jc1', 'jc2', 'wait']),
+    })
+    """
+
+    def __init__(self, id_: str, password: str, nodes: Dict[NodeId, Node]) -> None:
+        DanceAC.__init__(self, id_, password, {})
+        self.nodes = nodes
+        self.steps = {key: node.step for key, node in nodes.items()}  # type: ignore
+        self.active: Dict[NodeId, None] = {}  # ordered set
+        self.successors: Dict[NodeId, List[NodeId]] = {key: [] for key in nodes}
+        for key, node in nodes.items():
+            for input_ in node.after:
+                if input_ in self.successors:
+                    self.successors[input_].append(key)
+        self._node_of = {id(node.step): key for key, node in nodes.items()}
+        self._finished_inputs: Dict[NodeId, Set[NodeId]] = {}  # done or skipped inputs
+        self._done_inputs: Dict[NodeId, Set[NodeId]] = {}
+        self._loop_counts: Dict[NodeId, int] = {}
+        self._loop_bodies: Dict[NodeId, Set[NodeId]] = {}
+        self._when: Dict[NodeId, Dict[int, BlockChecker]] = {}
+        self._loop_while: Dict[NodeId, Dict[int, BlockChecker]] = {}
+        self._queue: Deque[Tuple[str, NodeId]] = collections.deque()
+        self._processing = False
+
+    def on_start(self) -> None:
+        logging.info('Start')
+        try:
+            self._validate()
+        except DanceStartException as e:
+            self.disp_error(str(e))
+            self.done()
+            return
+        if not self.start_steps():
+            return
+
+        self.active.clear()
+        self._queue.clear()
+        self._loop_counts.clear()
+        self._reset(self.nodes.keys(), set(self.nodes.keys()))
+        for key, node in self.nodes.items():
+            if not node.after:
+                self._queue.append(('ready', key))
+        if not self._queue:
+            self.done()
+            return
+        self._process()
+
+    def on_stop(self) -> None:
+        self.active.clear()
+        self._queue.clear()
+        DanceAC.on_stop(self)
+
+    def on_update(self) -> None:
+        AC.on_update(self)
+        if not self.running():
+            return
+        for key in list(self.active):
+            if key in self.active:
+                self.nodes[key].step.update(self)
+        self._process()
+
+    def is_active(self, step: Step) -> bool:
+        return self._node_of.get(id(step)) in self.active
+
+    def step_done(self, step: Optional[Step] = None) -> None:
+        key = self._node_of.get(id(step))
+        if key is None or key not in self.active:
+            return
+        logging.info(f'Step {key} done')
+        del self.active[key]
+        self._queue.append(('done', key))
+        self._process()
+
+    def send_step(self) -> None:
+        if self.running():
+            self.statestr = '\n'.join(
+                f'Aktuální krok {key}: {self.nodes[key].step.disp_str()}'
+                for key in self.active
+            )
+        self.statestr_send()
+
+    def prefetch(self) -> None:
+        """Prefetch active steps and their successors up to PREFETCH_LOOKAHEAD."""
+        seen = set(self.active)
+        level = list(self.active)
+        for _ in range(self.PREFETCH_LOOKAHEAD + 1):
+            for key in level:
+                self.nodes[key].step.prefetch(self)
+            level = [succ for key in level for succ in self.successors[key] if succ not in seen]
+            seen.update(level)
+
+    def _process(self) -> None:
+        """Process finished & ready nodes (not reentrant, steps could finish in `update`)."""
+        if self._processing or not self.running():
+            return
+        self._processing = True
+        changed = False
+        try:
+            while self._queue:
+                event, key = self._queue.popleft()
+                changed = True
+                if event == 'done':
+                    self._finish(key, True)
+                elif self._should_run(key, forced=(event == 'loop')):
+                    self.active[key] = None
+                    self.nodes[key].step.update(self)
+                else:
+                    logging.info(f'Step {key} skipped')
+                    self._finish(key, False)
+        finally:
+            self._processing = False
+
+        if not changed:
+            return
+        if not self.active:
+            logging.info('Done')
+            self.done()
+            return
+        self.prefetch()
+        self.send_step()
+
+    def _should_run(self, key: NodeId, forced: bool) -> bool:
+        node = self.nodes[key]
+        if node.after and not forced and not self._done_inputs[key]:
+            return False  # all inputs skipped
+        return key not in self._when or blocks_satisfy(self._when[key])
+
+    def _finish(self, key: NodeId, done: bool) -> None:
+        node = self.nodes[key]
+        if done and node.loop_to is not None and self._repeat(key):
+            body = self._loop_bodies[key]
+            self._reset(body, body)
+            self._queue.append(('loop', node.loop_to))
+            return
 
-@ac.blocks.on_block_change()
-def _on_block_change(block: ac.Block) -> None:
-    for acn in ACs.values():
-        if isinstance(acn, DanceAC):
-            acn.on_block_change(block)
+        for succ in self.successors[key]:
+            finished = self._finished_inputs[succ]
+            if key in finished:
+                continue  # input already finished in previous loop iteration
+            finished.add(key)
+            if done:
+                self._done_inputs[succ].add(key)
+            if len(finished) == len(set(self.nodes[succ].after)):
+                self._queue.append(('ready', succ))
+
+    def _repeat(self, key: NodeId) -> bool:
+        node = self.nodes[key]
+        count = self._loop_counts.get(key, 0)
+        if node.loops is not None and count >= node.loops:
+            return False
+        if key in self._loop_while and not blocks_satisfy(self._loop_while[key]):
+            return False
+        self._loop_counts[key] = count + 1
+        return True
+
+    def _reset(self, keys: Iterable[NodeId], inputs: Set[NodeId]) -> None:
+        """Mark `inputs` of nodes `keys` unfinished (inputs outside loop body stay)."""
+        for key in keys:
+            self._finished_inputs[key] = self._finished_inputs.get(key, set()) - inputs
+            self._done_inputs[key] = self._done_inputs.get(key, set()) - inputs
+
+    def _validate(self) -> None:
+        for key, node in self.nodes.items():
+            for input_ in node.after:
+                if input_ not in self.nodes:
+                    raise DanceStartException(f'Krok {key}: neexistující krok {input_}!')
+        if len(self._node_of) != len(self.nodes):
+            raise DanceStartException('Instance kroku je použita ve více uzlech!')
+
+        # Topological order (graph without loops must be acyclic)
+        pending = {key: len(node.after) for key, node in self.nodes.items()}
+        ready = [key for key, count in pending.items() if count == 0]
+        order = []
+        while ready:
+            key = ready.pop()
+            order.append(key)
+            for succ in self.successors[key]:
+                pending[succ] -= 1
+                if pending[succ] == 0:
+                    ready.append(succ)
+        if len(order) != len(self.nodes):
+            raise DanceStartException('Cyklická závislost kroků, použijte loop_to!')
+
+        self._when = {}
+        self._loop_while = {}
+        self._loop_bodies = {}
+        for key, node in self.nodes.items():
+            if node.when:
+                self._when[key] = block_checkers(node.when)
+            if node.loop_while:
+                self._loop_while[key] = block_checkers(node.loop_while)
+            if node.loop_to is not None:
+                body = self._between(node.loop_to, key)
+                if not body:
+                    raise DanceStartException(f'Krok {key}: krok {node.loop_to} nepředchází!')
+                self._loop_bodies[key] = body
+
+    def _between(self, first: NodeId, last: NodeId) -> Set[NodeId]:
+        """Return nodes on paths from `first` to `last` (empty if no path)."""
+        descendants = {first}
+        stack = [first]
+        while stack:
+            for succ in self.successors[stack.pop()]:
+                if succ not in descendants:
+                    descendants.add(succ)
+                    stack.append(succ)
+        if last not in descendants:
+            return set()
+        body = {last}
+        stack = [last]
+        while stack:
+            for input_ in self.nodes[stack.pop()].after:
+                if input_ in descendants and input_ not in body:
+                    body.add(input_)
+                    stack.append(input_)
+        return body
@@ -0,0 +1,257 @@
+"""JC (train/shunt path) helpers."""
+
+import concurrent.futures
+import http.client
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import ac
+import ac.blocks
+import ac.panel_client
+from ac import AC, pt
+
+JC = Dict[str, Any]
+JCsEvent = Callable[[List[JC]], None]
+
+
+def track_is_free(block: ac.Block) -> bool:
+    return bool(block['blockState']['state'] == 'free')
+
+
+class JCReadiness:
+    """
+    Tracks which JCs have all their tracks free.
+
+    For each JC, number of its non-free tracks is kept and updated
+    incrementally from changes of the tracks (only JCs containing the changed
+    track are touched). `on_ready` is called with list of JCs which became
+    ready (all tracks free). Tracks are subscribed on behalf of AC `acn`.
+
+    Example:
+    self.readiness = JCReadiness(self, self.on_jcs_ready)
+    self.readiness.add(jcs)
+    """
+
+    def __init__(self, acn: AC, on_ready: JCsEvent,
+                 is_free: Callable[[ac.Block], bool] = track_is_free) -> None:
+        self.acn = acn
+        self.on_ready = on_ready
+        self.is_free = is_free
+        self.jcs: Dict[int, JC] = {}
+        self.nonfree: Dict[int, int] = {}  # JC id -> number of non-free tracks
+        self._track_free: Dict[int, bool] = {}
+        self._track_jcs: Dict[int, Set[int]] = {}  # track id -> JC ids
+
+    def add(self, jcs: Iterable[JC]) -> None:
+        """Start tracking `jcs`, `on_ready` is called for already ready JCs."""
+        jcs = [jc for jc in jcs if jc['id'] not in self.jcs]
+        new_tracks = {track for jc in jcs for track in jc['tracks']} - \
+            set(self._track_jcs.keys())
+        # Subscribe before reading state: states read before REGISTER is sent
+        # are read again after it and changes are dispatched (see ac.blocks)
+        ac.blocks.subscribe(self.acn, self._on_block_change, *new_tracks)
+        for track, block in ac.blocks.get_many(new_tracks).items():
+            self._track_free[track] = self.is_free(block)
+
+        for jc in jcs:
+            self.jcs[jc['id']] = jc
+            self.nonfree[jc['id']] = sum(
+                1 for track in set(jc['tracks']) if not self._track_free[track]
+            )
+            for track in jc['tracks']:
+                self._track_jcs.setdefault(track, set()).add(jc['id'])
+
+        ready = [jc for jc in jcs if self.nonfree[jc['id']] == 0]
+        if ready:
+            self.on_ready(ready)
+
+    def remove(self, jc_id: int) -> None:
+        """Stop tracking JC, unsubscribe tracks not used by other JCs."""
+        jc = self.jcs.pop(jc_id, None)
+        if jc is None:
+            return
+        del self.nonfree[jc_id]
+        unused = []
+        for track in set(jc['tracks']):
+            self._track_jcs[track].discard(jc_id)
+            if not self._track_jcs[track]:
+                del self._track_jcs[track]
+                del self._track_free[track]
+                unused.append(track)
+        if unused:
+            ac.blocks.unsubscribe(self.acn, self._on_block_change, *unused)
+
+    def clear(self) -> None:
+        for jc_id in list(self.jcs.keys()):
+            self.remove(jc_id)
+
+    def ready(self) -> List[JC]:
+        """Return all ready JCs."""
+        return [self.jcs[jc_id] for jc_id, count in self.nonfree.items() if count == 0]
+
+    def _on_block_change(self, block: ac.Block) -> None:
+        track = block['id']
+        if track not in self._track_free:
+            return
+        free = self.is_free(block)
+        if free == self._track_free[track]:
+            return
+        self._track_free[track] = free
+
+        ready = []
+        for jc_id in self._track_jcs[track]:
+            self.nonfree[jc_id] += -1 if free else 1
+            if self.nonfree[jc_id] == 0:
+                ready.append(self.jcs[jc_id])
+        if ready:
+            self.on_ready(ready)
+
+
+JCResultEvent = Callable[[JC, Dict[str, Any]], None]
+JCErrorEvent = Callable[[JC, Exception], None]
+
+# Errors of PT request worth retrying
+TRANSIENT_ERRORS = (OSError, http.client.HTTPException)
+
+
+class JCActivator:
+    """
+    Activates JCs in background, at most `concurrency` at once. JCs with common
+    tracks are activated one after another in order of `activate` calls.
+
+    `on_result(jc, result)` is called with response of the server
+    ({'success': bool, 'barriers': [...]}), `on_error(jc, exception)` when the
+    request failed even after RETRIES retries with exponential backoff.
+    Callbacks are called in dispatcher lane of the AC (serialized with its
+    other handlers). Unsuccessful responses (barriers) are cached for
+    BARRIER_TTL seconds, repeated activation of the JC within this time does
+    not send any request, see `invalidate`.
+
+    Example:
+    self.activator = JCActivator(self, self.on_jc_result, self.on_jc_error)
+    self.activator.activate(jcs)
+    """
+
+    RETRIES = 3
+    BACKOFF = 0.5  # seconds, doubled with each retry
+    BARRIER_TTL = 1.0  # seconds
+
+    def __init__(self, acn: AC, on_result: JCResultEvent, on_error: JCErrorEvent,
+                 req_data: Optional[Dict[str, Any]] = None,
+                 concurrency: int = pt.POOL_SIZE) -> None:
+        self.acn = acn
+        self.on_result = on_result
+        self.on_error = on_error
+        self.req_data = req_data if req_data is not None else {}
+        self.concurrency = concurrency
+        self.queue: List[JC] = []
+        self.running: Dict[int, JC] = {}  # JC id -> JC (request or retry pending)
+        self._busy_tracks: Set[int] = set()
+        self._barriers: Dict[int, Tuple[float, Dict[str, Any]]] = {}  # JC id -> (time, result)
+        self._retries: Dict[int, ac.Timer] = {}
+        self._generation = 0  # responses of cancelled requests are ignored
+
+    def activate(self, jcs: Iterable[JC]) -> None:
+        queued = {jc['id'] for jc in self.queue}
+        for jc in jcs:
+            if jc['id'] not in queued and jc['id'] not in self.running:
+                self.queue.append(jc)
+                queued.add(jc['id'])
+        self._start_ready()
+
+    def cancel(self) -> None:
+        """Drop queued JCs and ignore results of running requests."""
+        self._generation += 1
+        for timer in self._retries.values():
+            timer.cancel()
+        self._retries.clear()
+        self.queue.clear()
+        self.running.clear()
+        self._busy_tracks.clear()
+
+    def invalidate(self, jc_id: Optional[int] = None) -> None:
+        """Drop cached barriers of JC (of all JCs)."""
+        if jc_id is None:
+            self._barriers.clear()
+        else:
+            self._barriers.pop(jc_id, None)
+
+    def pending(self) -> int:
+        return len(self.queue) + len(self.running)
+
+    def _start_ready(self) -> None:
+        blocked: Set[int] = set()  # tracks of waiting JCs, keeps order of conflicting JCs
+        waiting = []
+        for jc in self.queue:
+            tracks = set(jc['tracks'])
+            if len(self.running) >= self.concurrency or \
+                    not tracks.isdisjoint(self._busy_tracks) or not tracks.isdisjoint(blocked):
+                waiting.append(jc)
+                blocked |= tracks
+                continue
+
+            cached = self._barriers.get(jc['id'])
+            if cached is not None and time.monotonic() - cached[0] < self.BARRIER_TTL:
+                self._later(0, self._call_result, self._generation, jc, cached[1])
+                continue
+            self.running[jc['id']] = jc
+            self._busy_tracks |= tracks
+            self._put(jc, 0)
+        self.queue = waiting
+
+    def _put(self, jc: JC, attempt: int) -> None:
+        self._retries.pop(jc['id'], None)
+        future = pt.put_later(f'/jc/{jc["id"]}/state', self.req_data,
+                              self.acn.id, self.acn.password)
+        generation = self._generation
+        # Result is processed in panel client thread
+        future.add_done_callback(
+            lambda future: self._later(0, self._on_response, generation, jc, attempt, future)
+        )
+
+    def _on_response(self, generation: int, jc: JC, attempt: int,
+                     future: 'concurrent.futures.Future[Dict[str, Any]]') -> None:
+        if generation != self._generation:
+            return
+        try:
+            result = future.result()
+        except TRANSIENT_ERRORS as e:
+            if attempt < self.RETRIES:
+                delay = self.BACKOFF * 2**attempt
+                logging.warning(f'JC {jc["name"]}: {e}, retrying in {delay} s')
+                self._retries[jc['id']] = self._later(
+                    delay, self._retry, generation, jc, attempt+1,
+                )
+                return  # tracks stay busy, conflicting JCs wait
+            self._finish(jc)
+            self.on_error(jc, e)
+            return
+        except Exception as e:
+            self._finish(jc)
+            self.on_error(jc, e)
+            return
+
+        if result.get('success'):
+            self._barriers.pop(jc['id'], None)
+        else:
+            self._barriers[jc['id']] = (time.monotonic(), result)
+        self._finish(jc)
+        self.on_result(jc, result)
+
+    def _retry(self, generation: int, jc: JC, attempt: int) -> None:
+        if generation == self._generation:
+            self._put(jc, attempt)
+
+    def _later(self, delay: float, func: Callable[..., None], *args: Any) -> ac.Timer:
+        """Call `func(*args)` after `delay` in lane of the AC (see `ac.panel_client.dispatch`)."""
+        return ac.call_later(delay, ac.panel_client.dispatch, self.acn.id, func, *args)
+
+    def _call_result(self, generation: int, jc: JC, result: Dict[str, Any]) -> None:
+        if generation == self._generation:
+            self.on_result(jc, result)
+
+    def _finish(self, jc: JC) -> None:
+        self.running.pop(jc['id'], None)
+        self._busy_tracks -= set(jc['tracks'])
+        self._start_ready()
@@ -0,0 +1,101 @@
+"""
+Name -> id index of blocks & JCs shared by all ACs.
+
+Index is loaded by single `/blocks` and single `/jc` request and reloaded when
+older than TTL, after reconnect to the server (server configuration could have
+been reloaded) and on lookup of unknown name.
+
+Example:
+    utils.names.warm()  # at start of AC
+    jc_id = utils.names.jc_id('Klb S1 > Klb PriblL', 'VC')
+"""
+
+import threading
+import time
+from typing import Dict, Optional
+
+import ac
+from ac import pt
+
+TTL = 600.0  # seconds
+MISS_REFRESH_INTERVAL = 5.0  # seconds, minimal index age to reload on unknown name
+
+stats: Dict[str, int] = {'refreshes': 0, 'hits': 0, 'misses': 0}
+
+_blocks: Dict[str, int] = {}  # block name -> id
+_jcs: Dict[str, Dict[str, int]] = {}  # JC name -> JC type -> id
+_loaded: Optional[float] = None  # time.monotonic() of load, None = invalid
+_lock = threading.Lock()
+
+
+def refresh() -> None:
+    """Load index from server."""
+    global _blocks, _jcs, _loaded
+    blocks, jcs = pt.get_many(['/blocks', '/jc'])
+    new_jcs: Dict[str, Dict[str, int]] = {}
+    for jc in jcs['jc']:
+        new_jcs.setdefault(jc['name'], {})[jc['type']] = jc['id']
+    with _lock:
+        _blocks = {block['name']: block['id'] for block in blocks['blocks']}
+        _jcs = new_jcs
+        _loaded = time.monotonic()
+        stats['refreshes'] += 1
+
+
+def warm() -> None:
+    """Load index if not loaded or expired."""
+    if _age() >= TTL:
+        refresh()
+
+
+def invalidate() -> None:
+    global _loaded
+    _loaded = None
+
+
+def block_id(name: str) -> Optional[int]:
+    """Return id of block `name`, None if no such block exists."""
+    warm()
+    id_ = _blocks.get(name)
+    if id_ is None and _refresh_on_miss():
+        id_ = _blocks.get(name)
+    _count(id_)
+    return id_
+
+
+def jc_id(name: str, type_: Optional[str] = None) -> Optional[int]:
+    """Return id of JC `name` of type `type_` ('VC', 'PC', ... or any)."""
+    warm()
+    id_ = _find_jc(name, type_)
+    if id_ is None and _refresh_on_miss():
+        id_ = _find_jc(name, type_)
+    _count(id_)
+    return id_
+
+
+def _find_jc(name: str, type_: Optional[str]) -> Optional[int]:
+    types = _jcs.get(name, {})
+    if type_ is not None:
+        return types.get(type_)
+    return next(iter(types.values()), None)
+
+
+def _age() -> float:
+    loaded = _loaded
+    return float('inf') if loaded is None else time.monotonic() - loaded
+
+
+def _refresh_on_miss() -> bool:
+    if _age() < MISS_REFRESH_INTERVAL:
+        return False
+    refresh()
+    return True
+
+
+def _count(id_: Optional[int]) -> None:
+    stats['hits' if id_ is not None else 'misses'] += 1
+
+
+@ac.on_connect
+def _on_connect() -> None:
+    invalidate()  # ids could have changed while disconnected